@@ -0,0 +1,151 @@
+"""analyse.py - This file contains an offline tool which generates and
+solves a large number of boards, and writes statistics about them: how
+scores and word counts are distributed, how often each letter appears, and
+how many boards have no words at all.
+
+It runs outside App Engine, using every core of the machine:
+
+    python analyse.py words.dict --boards 1000000 --size 4 --output 4x4.json
+
+Boards are generated in chunks by worker processes, which share nothing but
+the memory-mapped dictionary. Each worker returns only the totals for its
+chunk, which are merged as they arrive. A different set of dice can be tried
+with --dice, a file with one die of 6 letters per line.
+"""
+
+import argparse
+from collections import Counter
+import json
+import multiprocessing
+import sys
+import time
+
+import boggle
+from dictionary import Dictionary
+import solver
+
+
+CHUNK_SIZE = 1000
+
+_dictionary = None
+
+
+def _start_worker(path, size, dice):
+    """Opens the dictionary once in each worker process"""
+    global _dictionary
+    _dictionary = Dictionary(path)
+    if dice is not None:
+        boggle.DICE[size] = dice
+
+
+def analyse_chunk(args):
+    """Generates and solves one chunk of boards, returning its totals.
+    Args:
+        args: a (seed, count, size) tuple. The same seed always produces the
+            same boards.
+    """
+    seed, count, size = args
+    scores = Counter()
+    word_counts = Counter()
+    letters = Counter()
+    for board_id, board in boggle.boards(count, size, seed):
+        words = [word for word in solver.solve(board, _dictionary)
+                 if boggle.word_points(word)]
+        scores[sum(boggle.word_points(word) for word in words)] += 1
+        word_counts[len(words)] += 1
+        letters.update(boggle.encode_board(board))
+    return count, scores, word_counts, letters
+
+
+def _chunks(boards, size, seed):
+    start = 0
+    while start < boards:
+        count = min(CHUNK_SIZE, boards - start)
+        yield seed * boards + start, count, size
+        start += count
+
+
+def read_dice(path):
+    """Reads a set of dice from a file with one die of 6 letters per line"""
+    with open(path) as f:
+        dice = [list(line.strip().upper()) for line in f if line.strip()]
+    for die in dice:
+        if len(die) != 6 or not ''.join(die).isalpha():
+            raise ValueError('Each die must have 6 letters: %s' % ''.join(die))
+    return dice
+
+
+def run(path, boards, size, seed=0, processes=None, dice=None,
+        progress=sys.stderr):
+    """Analyses boards across a pool of worker processes, and returns the
+    merged results as a dict."""
+    scores = Counter()
+    word_counts = Counter()
+    letters = Counter()
+    done = 0
+    start = time.time()
+    workers = multiprocessing.Pool(processes, _start_worker,
+                                   (path, size, dice))
+    try:
+        for count, chunk_scores, chunk_word_counts, chunk_letters in \
+                workers.imap_unordered(analyse_chunk,
+                                       _chunks(boards, size, seed)):
+            scores.update(chunk_scores)
+            word_counts.update(chunk_word_counts)
+            letters.update(chunk_letters)
+            done += count
+            progress.write('\r{}/{} boards, {:.0f} boards/s'.format(
+                done, boards, done / (time.time() - start)))
+        workers.close()
+    except:
+        workers.terminate()
+        raise
+    finally:
+        workers.join()
+    elapsed = time.time() - start
+    progress.write('\n')
+    return {
+        'size': size,
+        'boards': done,
+        'seconds': round(elapsed, 3),
+        'boards_per_second': round(done / elapsed, 1),
+        'no_words': word_counts[0],
+        # Histograms are [value, number of boards] pairs, sorted by value
+        'scores': sorted(scores.items()),
+        'word_counts': sorted(word_counts.items()),
+        'letters': dict(letters),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Generate and solve boards, and write their statistics.')
+    parser.add_argument('dictionary', help='a file built by dictionary.py')
+    parser.add_argument('--boards', type=int, default=100000)
+    parser.add_argument('--size', type=int, default=4,
+                        choices=boggle.BOARD_SIZES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='defaults to the number of cores')
+    parser.add_argument('--dice', help='a file with one die per line')
+    parser.add_argument('--output', help='defaults to standard output')
+    args = parser.parse_args(argv)
+
+    dice = None
+    if args.dice:
+        dice = read_dice(args.dice)
+        if len(dice) != args.size * args.size:
+            parser.error('a {0}x{0} board needs {1} dice'.format(
+                args.size, args.size * args.size))
+    results = run(args.dictionary, args.boards, args.size, args.seed,
+                  args.processes, dice)
+    output = json.dumps(results, sort_keys=True, separators=(',', ':'))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
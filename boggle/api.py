@@ -5,49 +5,182 @@ resources.
 
 
 import json
-import sys
-import xml.etree.ElementTree as ET
 
 import endpoints
-from google.appengine.api import (
-    memcache,
-    taskqueue,
-    urlfetch
-)
-from protorpc import remote, messages
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from protorpc import remote, messages, protojson
 
-from boggle import word_points
+from boggle import BOARD_SIZES, word_points
+import counters
+import instrument
 from models import (
     User,
     Game,
+    ArchivedGame,
+    Move,
     StringMessage,
     NewGameForm,
     GameForm,
     MakeMoveForm,
+    MakeMovesForm,
     UserPerformanceForms,
     UserGameForms,
     GameHistoryForm
 )
-from utils import get_by_urlsafe
+import pool
+from utils import (
+    get_by_urlsafe,
+    get_by_urlsafe_async,
+    english_words_async,
+    is_english_word_async,
+    transaction_async,
+    urlsafe_to_key
+)
 
 #  ## --- Resource Container Configuration --- ###  #
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1),)
 USER_GAMES_REQUEST = endpoints.ResourceContainer(
-    urlsafe_user_key=messages.StringField(1),)
+    urlsafe_user_key=messages.StringField(1),
+    cursor=messages.StringField(2),
+    limit=messages.IntegerField(3),)
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1),)
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(
+    MakeMovesForm,
+    urlsafe_game_key=messages.StringField(1),)
 USER_REQUEST = endpoints.ResourceContainer(
     user_name=messages.StringField(1),
     email=messages.StringField(2),)
+HISTORY_REQUEST = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    cursor=messages.StringField(2),
+    limit=messages.IntegerField(3),)
+RANKINGS_REQUEST = endpoints.ResourceContainer(
+    cursor=messages.StringField(1),
+    limit=messages.IntegerField(2),)
 CANCEL_GAME_REQUEST = endpoints.ResourceContainer(
     user_name=messages.StringField(1),
     urlsafe_game_key=messages.StringField(2),)
 
 
-MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
+USER_GAMES_PAGE_SIZE = 50
+RANKINGS_PAGE_SIZE = 50
+HISTORY_PAGE_SIZE = 100
+MEMCACHE_RANKINGS = 'RANKINGS'
+RANKINGS_CACHE_TTL = 60
+# The most guesses make_moves accepts in one request
+MAX_GUESSES_PER_MOVE = 100
+
+
+def _score_guess(game, user, guess, in_dictionary, on_board):
+    """Checks one guess by the user, and adds its points to the game if it
+    is correct. Returns the points and a message.
+    Args:
+        in_dictionary: whether the guess is an english word
+        on_board: a function returning True if a word can be constructed
+            from the board
+    """
+    # Check that the word is in the English dictionary:
+    if not in_dictionary:
+        return 0, 'Sorry! "{}" is not in the english dictionary'.format(guess)
+    # Check that this word hasn't already been found
+    if guess in game.found_words():
+        return 0, 'Sorry! "{}" that word has already been found'.format(guess)
+    # Check that the word can be found on the board
+    if not on_board(guess):
+        return 0, 'Sorry! The word "{}" is not in the board.'.format(guess)
+    # The word passes all our checks
+    # calculate and add points to the users's total for this game
+    points = word_points(guess)
+    game.add_found_word(guess)
+    if user.key == game.user1:
+        game.user1_points += points
+    else:
+        game.user2_points += points
+    return points, 'Correct! {} points for the word "{}"'.format(points, guess)
+
+
+def _get_game(urlsafe_game_key):
+    """Returns the game a urlsafe key points to, or None if it doesn't
+    exist. Games which have been archived are restored from the archive,
+    see archive.py. Also returns the ArchivedGame, or None if the game
+    isn't archived."""
+    game = get_by_urlsafe(urlsafe_game_key, Game)
+    if game is not None:
+        return game, None
+    key = urlsafe_to_key(urlsafe_game_key)
+    if key.kind() != Game._get_kind():
+        return None, None
+    archived = ArchivedGame.get_by_id(key.id())
+    if archived is None:
+        return None, None
+    return archived.restore(), archived
+
+
+@ndb.tasklet
+def _take_turn_async(urlsafe_game_key, user, play):
+    """Plays the user's turn in a game, and returns the game form.
+
+    The game is read, and if it is the user's turn, play(game) is called to
+    check and score the guesses. It returns a list of (guess, points,
+    message) tuples, one for each Move to record, and the message for the
+    response. The game, its moves and any users who finished the game are
+    written in one put_multi, inside one transaction.
+    """
+    @ndb.tasklet
+    def turn():
+        game = yield get_by_urlsafe_async(urlsafe_game_key, Game)
+        if game is None:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.game_over:
+            raise ndb.Return(game, 'Game already over!', {})
+        if user is None:
+            raise ndb.Return(game, 'Player not found.', {})
+        if user.key not in [game.user1, game.user2]:
+            raise ndb.Return(game, 'You\'re not playing in this game', {})
+
+        # Make sure it is this user's turn
+        whose_turn = game.user2
+        if game.user1_is_next:
+            whose_turn = game.user1
+        if user.key != whose_turn:
+            raise ndb.Return(game, 'It\'s not your turn', {})
+        # All these checks have passed, so the turn can proceed, and the
+        # game will be updated:
+        game.user1_is_next = not game.user1_is_next
+        game.turns_remaining -= 1
+        yield counters.increment_async(counters.TURNS_REMAINING, -1)
+        moves, msg = play(game)
+        users = {user.key: user}
+        entities = [game]
+        if game.turns_remaining < 1:
+            game.turns_remaining = 0
+            winner, loser = yield game.end_game_async()
+            if winner is None:
+                ending = " It's a tie!"
+            else:
+                ending = "{} wins!".format(winner.name)
+                users.update({winner.key: winner, loser.key: loser})
+                entities += [winner, loser]
+            # The last move records how the game ended
+            last_guess, last_points, last_msg = moves[-1]
+            moves[-1] = last_guess, last_points, last_msg + ending
+            msg += ending + ' Game over!'
+        for guess, points, move_msg in moves:
+            entities.append(game.record_move(user, guess, points, move_msg))
+        yield ndb.put_multi_async(entities)
+        raise ndb.Return(game, msg, users)
+
+    game, msg, users = yield transaction_async('move', turn)
+    if game.game_over and len(users) > 1:
+        # The winner and loser have moved in the rankings
+        yield ndb.get_context().memcache_delete(MEMCACHE_RANKINGS)
+    raise ndb.Return(game.to_form(msg, users))
 
 
 @endpoints.api(name='boggle', version='v1')
@@ -58,13 +191,23 @@ class BoggleApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrument.instrumented
     def create_user(self, request):
         """Create a User. Requires a unique username."""
-        if User.query(User.name == request.user_name).get():
+        if User.get_by_name_async(request.user_name).get_result():
             raise endpoints.ConflictException(
                     'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
+
+        @ndb.transactional
+        def create():
+            # The key is the normalized name, so checking for it inside a
+            # transaction makes sure two requests can't both create it.
+            key = User.key_for(request.user_name)
+            if key.get():
+                raise endpoints.ConflictException(
+                        'A User with that name already exists!')
+            User(key=key, name=request.user_name, email=request.email).put()
+        create()
         return StringMessage(message='User {} created!'.format(
                 request.user_name))
 
@@ -73,52 +216,61 @@ class BoggleApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrument.instrumented
+    @ndb.synctasklet
     def new_game(self, request):
         """Creates and responds with a new game.
-        Each game has a randomly generated board, two players, and
-        a customizable number of turns allowed. The Game model also contains
-        a number of variables for tracking the game state.
+        Each game has a randomly generated board of a chosen size, two
+        players, and a customizable number of turns allowed. The Game model
+        also contains a number of variables for tracking the game state.
         """
-        user1_name = request.user1_name
-        user1 = User.query(User.name == request.user1_name).get()
+        # Look both users up at the same time
+        user1, user2 = yield (
+            User.get_by_name_async(request.user1_name),
+            User.get_by_name_async(request.user2_name))
         if not user1:
             raise endpoints.NotFoundException(
-                    'A User named %s does not exist!' % user1_name)
-        user2_name = request.user2_name
-        user2 = User.query(User.name == request.user2_name).get()
+                    'A User named %s does not exist!' % request.user1_name)
         if not user2:
             raise endpoints.NotFoundException(
-                    'A User named %s does not exist!' % user2_name)
-        if user1.name == user2.name:
+                    'A User named %s does not exist!' % request.user2_name)
+        if user1.key == user2.key:
             raise endpoints.NotFoundException(
                 'Sorry, you can\'t play against yourself'
             )
-        try:
-            game = Game.new_game(user1.key, user2.key, request.turns)
-            user1.games.append(game.key)
-            user2.games.append(game.key)
-        except:
-            raise endpoints.BadRequestException('Bad request')
+        if request.turns < 1:
+            raise endpoints.BadRequestException(
+                'A game needs at least one turn')
+        if request.board_size not in BOARD_SIZES:
+            raise endpoints.BadRequestException(
+                'The board size must be one of {}'.format(BOARD_SIZES))
+        if (request.difficulty is not None and
+                request.difficulty not in pool.DIFFICULTIES):
+            raise endpoints.BadRequestException(
+                'The difficulty must be one of {}'.format(pool.DIFFICULTIES))
+        # Choose a pooled board before the transaction, since queries can't
+        # run inside it
+        pool_key = yield pool.candidate_async(request.board_size,
+                                              request.difficulty)
+        game = yield transaction_async(
+            'new_game',
+            lambda: Game.new_game_async(user1, user2, request.turns,
+                                        request.board_size, pool_key))
+        if pool_key is None:
+            pool.queue_refill(request.board_size)
         else:
-            user1.put()
-            user2.put()
-        # Use a task queue to update the average turns remaining.
-        # This operation is not needed to complete the creation of a new game
-        # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_average_turns')
-        msg = 'Good luck playing boggle {} and {}.'.format(
-                user1.name, user2.name
-        )
-        return game.to_form('Good luck playing Boggle!')
+            yield pool.check_low_water_async(request.board_size)
+        raise ndb.Return(game.to_form('Good luck playing Boggle!'))
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrument.instrumented
     def get_game(self, request):
         """Get the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game, archived = _get_game(request.urlsafe_game_key)
         if game is not None:
             return game.to_form('Time to make a move!')
         else:
@@ -129,185 +281,222 @@ class BoggleApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrument.instrumented
+    @ndb.synctasklet
     def make_move(self, request):
         """A player submits a "guess" for a word found on the board.
         The guess is checked for validity, and the game state updated
         accordingly.
         Returns a game state with message.
         """
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game.game_over:
-            return game.to_form('Game already over!')
-        user_name = request.user_name
-        user = User.query(User.name == request.user_name).get()
-        if user is None:
-            return game.to_form('Player not found.')
-        if user.key not in [game.user1, game.user2]:
-            return game.to_form('You\'re not playing in this game')
-
-        # Make sure it is this user's turn
-        whose_turn = game.user2
-        if game.user1_is_next:
-            whose_turn = game.user1
-        if user.key != whose_turn:
-            return game.to_form('It\'s not your turn')
-        # All these checks have passed, so the turn can proceed, and the game
-        # will be updated:
-        game.user1_is_next = not game.user1_is_next
-        game.turns_remaining -= 1
-        msg = ""
         # make the submitted word all caps for checking.
         guess = request.guess.upper()
-        # Use the Merriam-Webster API to check that the word is in the
-        # English dictionary:
-        dictionary_url = "http://www.dictionaryapi.com"\
-                         "/api/v1/references/collegiate/xml/{word}?key={key}"
-        dict_lookup = urlfetch.Fetch(
-            # I realize that publishing API keys on GitHub is bad practice,
-            # but for the purposes of this project, the risks are minimal.
-            dictionary_url.format(word=guess,
-                                  key='a910e27f-cb8e-4d10-9a2d-b8bf3530c02d')
-        )
-        # The Merriam-Webster API returns an XML string. If the word is found
-        # the XML will contain an <entry> tag.
-        # Use the ElementTree XML API module to look for the <entry> tag
-        parsed_xml = ET.fromstring(dict_lookup.content)
-        entry = parsed_xml.find('entry')
-        if entry is None:
-            msg += 'Sorry! "{}" is not in the english dictionary'.format(guess)
-        # Check that this word hasn't already been found
-        elif guess in game.words_found:
-            msg += 'Sorry! "{}" that word has already been found'.format(guess)
-        # Check that the word can be found on the board
-        elif not game.check_word(guess):
-            msg += 'Sorry! The word "{}" is not in the board.'.format(guess)
-        else:
-            # The word passes all our checks
-            # calculate and add points to the users's total for this game
-            points = word_points(guess)
-            game.words_found.append(guess)
-            if user.key == game.user1:
-                game.user1_points += points
-            else:
-                game.user2_points += points
-            msg += 'Correct! {} points for the word "{}"'.format(points, guess)
-        game.put()
-        if game.turns_remaining < 1:
-            game.turns_remaining = 0
-            w, l = game.end_game()
-            winner = w.get()
-            msg += "{} wins!".format(winner.name)
-            game.enter_history(user, msg)
-            return game.to_form(msg + ' Game over!')
-        else:
-            game.enter_history(user, msg)
-            return game.to_form(msg)
+        # The user and the dictionary lookup don't depend on each other, so
+        # they are started at once.
+        user, in_dictionary = yield (
+            User.get_by_name_async(request.user_name),
+            is_english_word_async(guess))
+
+        def play(game):
+            points, msg = _score_guess(game, user, guess, in_dictionary,
+                                       game.check_word)
+            return [(guess, points, msg)], msg
+
+        form = yield _take_turn_async(request.urlsafe_game_key, user, play)
+        raise ndb.Return(form)
+
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/moves',
+                      name='make_moves',
+                      http_method='PUT')
+    @instrument.instrumented
+    @ndb.synctasklet
+    def make_moves(self, request):
+        """A player submits several guesses at once, for automated players
+        and testing. The whole batch is one turn: each guess is checked and
+        scored as make_move would, then the other player has the next turn.
+        Returns a game state with a message for each guess.
+        """
+        guesses = [guess.upper() for guess in request.guesses]
+        if not guesses:
+            raise endpoints.BadRequestException('No guesses were submitted')
+        if len(guesses) > MAX_GUESSES_PER_MOVE:
+            raise endpoints.BadRequestException(
+                'At most {} guesses can be submitted at once'.format(
+                    MAX_GUESSES_PER_MOVE))
+        user, in_dictionary = yield (
+            User.get_by_name_async(request.user_name),
+            english_words_async(guesses))
+
+        def play(game):
+            # Check every dictionary word against the board in one pass
+            on_board = game.check_words(in_dictionary)
+            found_before = len(game.found_words())
+            moves = []
+            messages = []
+            total = 0
+            for guess in guesses:
+                points, msg = _score_guess(game, user, guess,
+                                           guess in in_dictionary,
+                                           on_board.__contains__)
+                moves.append((guess, points, msg))
+                messages.append(msg)
+                total += points
+            summary = '{} of {} guesses correct for {} points.'.format(
+                len(game.found_words()) - found_before, len(guesses), total)
+            return moves, ' '.join([summary] + messages)
+
+        form = yield _take_turn_async(request.urlsafe_game_key, user, play)
+        raise ndb.Return(form)
 
     @endpoints.method(response_message=StringMessage,
                       path='games/average_turns',
                       name='get_average_turns_remaining',
                       http_method='GET')
+    @instrument.instrumented
     def get_average_turns(self, request):
-        """Get the cached average moves remaining"""
+        """Get the average moves remaining in open games"""
+        totals = counters.get_totals_async(
+            [counters.OPEN_GAMES, counters.TURNS_REMAINING]).get_result()
+        if totals[counters.OPEN_GAMES] < 1:
+            return StringMessage(message='')
+        average = (float(totals[counters.TURNS_REMAINING]) /
+                   totals[counters.OPEN_GAMES])
         return StringMessage(
-            message=memcache.get(MEMCACHE_MOVES_REMAINING) or '')
+            message='The average moves remaining is {:.2f}'.format(average))
 
     @endpoints.method(request_message=CANCEL_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}/cancel',
                       name='cancel_game',
                       http_method='PUT')
+    @instrument.instrumented
+    @ndb.synctasklet
     def cancel_game(self, request):
         """Allow a user to forfeit by cancelling a game."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game.game_over:
-            return game.to_form('Game already over!')
-        user = User.query(User.name == request.user_name).get()
-        if game.key not in user.games:
-            return game.to_form('Only the participants can cancel a game')
-        # make the other user the winner
-        w, l = game.end_game(cancelled_by=user.key)
-        winner = w.get()
-        loser = l.get()
-        return game.to_form("{} cancelled the game. {} wins!"
-                            .format(loser.name, winner.name))
+        user = yield User.get_by_name_async(request.user_name)
+
+        @ndb.tasklet
+        def cancel():
+            game = yield get_by_urlsafe_async(request.urlsafe_game_key, Game)
+            if game is None:
+                raise endpoints.NotFoundException('Game not found!')
+            if game.game_over:
+                raise ndb.Return(game, 'Game already over!', {})
+            if user is None or user.key not in (game.user1, game.user2):
+                raise ndb.Return(
+                    game, 'Only the participants can cancel a game', {})
+            # make the other user the winner
+            winner, loser = yield game.end_game_async(cancelled_by=user.key)
+            yield ndb.put_multi_async([game, winner, loser])
+            raise ndb.Return(game,
+                             "{} cancelled the game. {} wins!".format(
+                                 loser.name, winner.name),
+                             {winner.key: winner, loser.key: loser})
+
+        game, msg, users = yield transaction_async('cancel', cancel)
+        if users:
+            # The winner and loser have moved in the rankings
+            yield ndb.get_context().memcache_delete(MEMCACHE_RANKINGS)
+        raise ndb.Return(game.to_form(msg, users))
 
     @endpoints.method(request_message=USER_GAMES_REQUEST,
                       response_message=UserGameForms,
                       path='user/{urlsafe_user_key}',
                       name='get_user_games',
                       http_method='GET')
+    @instrument.instrumented
     def get_user_games(self, request):
-        """Return the a list of game states for a user."""
+        """Return a page of the active games of a user. Pass the
+        next_cursor of the response as the cursor of the next request to get
+        the following page."""
         user = get_by_urlsafe(request.urlsafe_user_key, User)
-        if user is not None:
-            print user.games
-            games_list = []
-            for index, key in enumerate(user.games):
-                try:
-                    game = key.get()
-                except TypeError as e:
-                    print "Type error on index {}: {} ".format(index, e)
-                except Exception as e:
-                    exc_type, exc_obj, exc_tb = sys.exc_info()
-                    print exc_type, exc_obj
-                else:
-                    if not game.game_over:
-                        games_list.append(game)
-            return UserGameForms(
-                user=user.to_form(),
-                games=[game.to_form(
-                    '{name} is a player in this active game'.
-                    format(name=user.name)) for game in games_list]
-            )
-        else:
+        if user is None:
             raise endpoints.NotFoundException('User not found!')
+        cursor = None
+        if request.cursor:
+            cursor = Cursor(urlsafe=request.cursor)
+        limit = min(request.limit or USER_GAMES_PAGE_SIZE, USER_GAMES_PAGE_SIZE)
+        games, next_cursor, more = Game.query(
+            Game.players == user.key,
+            Game.game_over == False).fetch_page(limit, start_cursor=cursor)
+        message = '{name} is a player in this active game'.format(
+            name=user.name)
+        return UserGameForms(
+            user=user.to_form(),
+            games=Game.to_forms(games, message),
+            next_cursor=next_cursor.urlsafe() if more else None
+        )
 
-    @endpoints.method(response_message=UserPerformanceForms,
+    @endpoints.method(request_message=RANKINGS_REQUEST,
+                      response_message=UserPerformanceForms,
                       path='user_rankings',
                       name='get_user_rankings',
                       http_method='GET')
+    @instrument.instrumented
     def get_user_rankings(self, request):
-        """Returns a list of users ranked by win_percentage and then
-        by totals wins."""
-        users = User.query()
-        users = users.order(-User.wins)
-        # win_percentage is derived from an entity method, so we can't use
-        # the query.order method. We'll use a list sort instead.
-        users_list = [u.to_performance_form() for u in users]
-        users_list.sort(key=lambda user: -user.win_percentage)
-        response = UserPerformanceForms(users=users_list)
+        """Returns a page of users ranked by win_percentage and then
+        by totals wins. Pass the next_cursor of the response as the cursor of
+        the next request to get the following page."""
+        # The first page is the most requested, so it is cached
+        first_page = not request.cursor and not request.limit
+        if first_page:
+            cached = memcache.get(MEMCACHE_RANKINGS)
+            if cached is not None:
+                return protojson.decode_message(UserPerformanceForms, cached)
+        cursor = None
+        if request.cursor:
+            cursor = Cursor(urlsafe=request.cursor)
+        limit = min(request.limit or RANKINGS_PAGE_SIZE, RANKINGS_PAGE_SIZE)
+        users, next_cursor, more = User.query().order(
+            -User.win_percentage, -User.wins).fetch_page(
+                limit, start_cursor=cursor)
+        response = UserPerformanceForms(
+            users=[u.to_performance_form() for u in users],
+            next_cursor=next_cursor.urlsafe() if more else None)
+        if first_page:
+            memcache.set(MEMCACHE_RANKINGS,
+                         protojson.encode_message(response),
+                         time=RANKINGS_CACHE_TTL)
         return response
 
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=HISTORY_REQUEST,
                       response_message=GameHistoryForm,
                       path='games/{urlsafe_game_key}/history',
                       name='get_game_history',
                       http_method='GET')
+    @instrument.instrumented
     def get_game_history(self, request):
-        """Returns the history of moves for a game."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game is not None:
-            response = GameHistoryForm(
-                game=game.to_form('Here is the history of this game'),
-                turns=[json.dumps(turn) for turn in game.history]
-            )
-            return response
-        else:
+        """Returns a page of the history of moves for a game. Pass the
+        next_cursor of the response as the cursor of the next request to get
+        the following page."""
+        game, archived = _get_game(request.urlsafe_game_key)
+        if game is None:
             raise endpoints.NotFoundException('Game not found!')
-
-    @staticmethod
-    def _cache_average_turns():
-        """Populates memcache with the average moves remaining of Games"""
-        games = Game.query(Game.game_over == False).fetch()
-        if games:
-            count = len(games)
-            total_turns_remaining = sum([game.turns_remaining
-                                        for game in games])
-            average = float(total_turns_remaining)/count
-            memcache.set(
-                MEMCACHE_MOVES_REMAINING,
-                'The average moves remaining is {:.2f}'.format(average)
-            )
+        if archived is not None:
+            # Archived games are finished, and their moves are returned in
+            # one page
+            return GameHistoryForm(
+                game=game.to_form('Here is the history of this game'),
+                turns=[json.dumps(turn) for turn in archived.turn_list()])
+        cursor = None
+        if request.cursor:
+            cursor = Cursor(urlsafe=request.cursor)
+        limit = min(request.limit or HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE)
+        # Moves are numbered by their key id, so key order is move order
+        moves, next_cursor, more = Move.query(ancestor=game.key).order(
+            Move.key).fetch_page(limit, start_cursor=cursor)
+        turns = [json.dumps(move.to_turn()) for move in moves]
+        if cursor is None and game.history:
+            # Games started before moves were stored as separate entities
+            # keep their earlier moves in the game. They come first, all on
+            # the first page.
+            turns = [json.dumps(turn) for turn in game.history] + turns
+        return GameHistoryForm(
+            game=game.to_form('Here is the history of this game'),
+            turns=turns,
+            next_cursor=next_cursor.urlsafe() if more else None
+        )
 
 api = endpoints.api_server([BoggleApi])
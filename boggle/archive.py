@@ -0,0 +1,102 @@
+"""archive.py - This file contains the jobs which keep the Game kind small:
+games left idle for IDLE_TTL are ended, and games finished for longer than
+ARCHIVE_AFTER are moved into the ArchivedGame kind, together with their
+moves. Each job works through one page of games per call, so that main.py
+can run it as a chain of tasks.
+
+An idle game is forfeited by the player whose turn it is, as if they had
+cancelled it. Games without an updated time, which haven't been played
+since it was added, are left alone until migrations.backfill_game_updated
+gives them one.
+"""
+
+import datetime
+
+from google.appengine.ext import ndb
+
+from models import (
+    ArchivedGame,
+    Game,
+    Move
+)
+
+
+PAGE_SIZE = 50
+IDLE_TTL = datetime.timedelta(days=14)
+ARCHIVE_AFTER = datetime.timedelta(days=30)
+
+
+@ndb.tasklet
+def _expire_async(key, cutoff):
+    """Ends a game which hasn't changed since cutoff, and returns True, or
+    returns False if it was played or ended since it was queried."""
+    game = yield key.get_async()
+    if (game is None or game.game_over or game.updated is None or
+            game.updated >= cutoff):
+        raise ndb.Return(False)
+    idle = game.user1 if game.user1_is_next else game.user2
+    winner, loser = yield game.end_game_async(cancelled_by=idle)
+    game.game_cancelled = True
+    msg = '{} let the game expire. {} wins!'.format(loser.name, winner.name)
+    yield ndb.put_multi_async([game, winner, loser,
+                               game.record_move(loser, None, 0, msg)])
+    raise ndb.Return(True)
+
+
+@ndb.tasklet
+def _archive_async(key):
+    """Moves a finished game into the archive, and returns its moves' keys
+    so that they can be deleted. Returns None if the game is already
+    archived."""
+    game = yield key.get_async()
+    if game is None or game.updated is None:
+        raise ndb.Return(None)
+    moves = yield Move.query(ancestor=key).order(Move.key).fetch_async()
+    yield (ArchivedGame.from_game(game, moves).put_async(),
+           key.delete_async())
+    raise ndb.Return([move.key for move in moves])
+
+
+@ndb.synctasklet
+def expire_idle_games(now, cursor):
+    """Ends one page of games which haven't changed for IDLE_TTL.
+    Returns the number of games ended and the cursor of the next page, which
+    is None when there are no more. Games without an updated time sort first
+    in the query, and are skipped."""
+    cutoff = now - IDLE_TTL
+    keys, next_cursor, more = yield Game.query(
+        Game.game_over == False, Game.updated < cutoff).fetch_page_async(
+            PAGE_SIZE, start_cursor=cursor, keys_only=True)
+    # Every game is ended in its own transaction, one after another: ending
+    # a game writes both its players, and games which share a player would
+    # collide if they ended at the same time.
+    expired = 0
+    for key in keys:
+        ended = yield ndb.transaction_async(
+            lambda key=key: _expire_async(key, cutoff), xg=True)
+        expired += ended
+    raise ndb.Return(expired, next_cursor if more else None)
+
+
+@ndb.synctasklet
+def archive_finished_games(now, cursor):
+    """Archives one page of games which finished at least ARCHIVE_AFTER ago.
+    Returns the number of games archived and the cursor of the next page,
+    which is None when there are no more."""
+    keys, next_cursor, more = yield Game.query(
+        Game.game_over == True, Game.updated < now - ARCHIVE_AFTER
+    ).fetch_page_async(PAGE_SIZE, start_cursor=cursor, keys_only=True)
+    # Every game is archived in its own transaction, all at the same time
+    results = yield [ndb.transaction_async(
+        lambda key=key: _archive_async(key), xg=True)
+        for key in keys]
+    archived = [move_keys for move_keys in results if move_keys is not None]
+    # A game can have more moves than a transaction can write, so they're
+    # deleted once the game is safely archived.
+    yield ndb.delete_multi_async(
+        [move_key for move_keys in archived for move_key in move_keys])
+    raise ndb.Return(len(archived), next_cursor if more else None)
+
+
+# The jobs in the order they run
+JOBS = [('expire', expire_idle_games), ('archive', archive_finished_games)]
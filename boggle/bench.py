@@ -0,0 +1,221 @@
+"""bench.py - This file contains the benchmarks of the game engine in
+boggle.py: generating boards, finding the letters and paths of words on
+boards with more or fewer repeated letters, boards which are almost all one
+letter, and scoring words.
+
+    python bench.py --output results.json
+    python bench.py --baseline results.json --threshold 25
+
+Every benchmark uses fixed seeds, and reports the best time per call in
+microseconds out of several repeats. The repeats of each benchmark are
+spread across the whole run, one round of every benchmark after another, so
+a burst of load on the machine slows one repeat of many benchmarks rather
+than every repeat of one. With --baseline, benchmarks which are more than
+--threshold percent slower than the baseline are listed, and the exit
+status is 1, so that a build can fail on a regression. Runs of the same
+code on a shared machine still differ by up to about 11%, so the default
+threshold is 25%.
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import boggle
+
+
+REPEATS = 10
+# Each benchmark is timed over at least this many seconds per repeat
+MIN_TIME = 0.05
+WORD_LENGTHS = [3, 5, 8, 12]
+
+# 4x4 boards with more and more repeated letters, row by row
+BOARDS = {
+    'distinct': 'ABCDEFGHIJKLMNOP',
+    'pairs': 'ABCDEFGHABCDEFGH',
+    'four_letters': 'ABCDBCDACDABDABC',
+    'uniform': 'E' * 16,
+}
+
+
+def _time(fn, inputs, calls):
+    start = time.time()
+    for i in range(calls):
+        for item in inputs:
+            fn(item)
+    return time.time() - start
+
+
+def calibrate(fn, inputs):
+    """Returns the number of passes over the inputs which take at least
+    MIN_TIME"""
+    calls = 1
+    while _time(fn, inputs, calls) < MIN_TIME:
+        calls *= 2
+    return calls
+
+
+def random_path_word(letters, size, length, rng):
+    """Returns a word spelled by a random path on the board, or None if the
+    walk got stuck before reaching the length."""
+    table = boggle.NEIGHBOURS[size]
+    index = rng.randrange(size * size)
+    path = [index]
+    while len(path) < length:
+        free = [n for n in table[index] if n not in path]
+        if not free:
+            return None
+        index = rng.choice(free)
+        path.append(index)
+    return ''.join(letters[i] for i in path)
+
+
+def path_words(letters, size, length, count, rng):
+    """Returns count words of the given length which are on the board"""
+    words = []
+    while len(words) < count:
+        word = random_path_word(letters, size, length, rng)
+        if word is not None:
+            words.append(word)
+    return words
+
+
+def shuffled(words, rng):
+    """Returns the words with their letters shuffled, which are usually
+    not on the board, though their letters are"""
+    result = []
+    for word in words:
+        letters = list(word)
+        rng.shuffle(letters)
+        result.append(''.join(letters))
+    return result
+
+
+def bench_boards(cases):
+    for size in boggle.BOARD_SIZES:
+        cases.append(('board/{}x{}'.format(size, size),
+                      lambda seed, size=size: boggle.board(size, seed),
+                      range(100), 1))
+        cases.append(('boards/{}x{}'.format(size, size),
+                      lambda seed, size=size: boggle.boards(100, size, seed),
+                      range(5), 100))
+
+
+def bench_words(cases):
+    rng = random.Random(0)
+    boards = dict(BOARDS)
+    boards['random'] = boggle.encode_board(boggle.board(4, seed=0))
+    for name, letters in sorted(boards.items()):
+        board = boggle.decode_board(letters, 4)
+        for length in WORD_LENGTHS:
+            hits = path_words(letters, 4, length, 20, rng)
+            misses = shuffled(hits, rng)
+            key = '{}/{}/len{}'.format('{}', name, length)
+            cases.append((key.format('find_letters'),
+                          lambda word, board=board:
+                          boggle.find_letters(word, board), hits, 1))
+            cases.append((key.format('find_path_hit'),
+                          lambda word, board=board:
+                          boggle.find_path(word, board), hits, 1))
+            cases.append((key.format('find_path_shuffled'),
+                          lambda word, board=board:
+                          boggle.find_path(word, board), misses, 1))
+
+
+def bench_adversarial(cases):
+    """Boards which are almost all one letter.
+
+    Words of only that letter are found by the first branch searched, so
+    they are the best case. The worst case is a word which starts and ends
+    with the common letter, and needs two rare letters next to each other
+    which aren't: every path of common letters before them is tried from
+    every start. Its cost grows about 3-5 times with each extra leading
+    letter, so the word lengths are chosen to keep each call under a
+    fraction of a second. A 6x6 miss with 9 leading letters takes over 10 s.
+    """
+    for size in boggle.BOARD_SIZES:
+        n = size * size
+        board = boggle.decode_board('E' * n, size)
+        for length in (n // 2, n):
+            cases.append(('adversarial/{}x{}/len{}_hit'.format(
+                size, size, length),
+                lambda word, board=board: boggle.find_path(word, board),
+                ['E' * length], 1))
+    # Two A's in separate corners, so no path spells AA
+    for size, leading in ((4, 8), (5, 7), (6, 6)):
+        n = size * size
+        letters = ['E'] * n
+        letters[size - 1] = letters[n - 1] = 'A'
+        board = boggle.decode_board(''.join(letters), size)
+        cases.append(('adversarial/{}x{}/near_uniform_miss'.format(size, size),
+                      lambda word, board=board: boggle.find_path(word, board),
+                      ['E' * leading + 'AAE'], 1))
+
+
+def bench_points(cases):
+    words = ['A' * length for length in range(1, 17)]
+    cases.append(('word_points', boggle.word_points, words, 1))
+
+
+BENCHMARKS = [bench_boards, bench_words, bench_adversarial, bench_points]
+
+
+def run():
+    """Runs every benchmark, and returns a dict of microseconds per call by
+    benchmark name"""
+    # Each case is (name, fn, inputs, operations per call)
+    cases = []
+    for bench in BENCHMARKS:
+        bench(cases)
+    calls = [calibrate(fn, inputs) for name, fn, inputs, per in cases]
+    results = {}
+    for repeat in range(REPEATS):
+        for (name, fn, inputs, per), n in zip(cases, calls):
+            us = _time(fn, inputs, n) / (n * len(inputs) * per) * 1e6
+            results[name] = min(results.get(name, us), us)
+    return dict((name, round(us, 3)) for name, us in results.items())
+
+
+def regressions(results, baseline, threshold):
+    """Returns a list of (name, baseline, result) for the benchmarks more
+    than threshold percent slower than the baseline"""
+    slower = []
+    for name, us in sorted(results.items()):
+        before = baseline.get(name)
+        if before and us > before * (1 + threshold / 100.0):
+            slower.append((name, before, us))
+    return slower
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the game engine in boggle.py.')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='results to compare with')
+    parser.add_argument('--threshold', type=float, default=25,
+                        help='the percent slower which fails a comparison')
+    args = parser.parse_args(argv)
+
+    results = run()
+    for name in sorted(results):
+        print '{:<45} {:>12.3f} us'.format(name, results[name])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'results': results}, f, sort_keys=True, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        slower = regressions(results, baseline, args.threshold)
+        for name, before, after in slower:
+            print '{} is {:.0f}% slower: {:.3f} us -> {:.3f} us'.format(
+                name, (after / before - 1) * 100, before, after)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
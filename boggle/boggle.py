@@ -4,15 +4,11 @@ boggle board, and determine if the word exists on the board."""
 import random
 
 
-# build a list of lists, each on representing a dice:
-def board():
-    """Returns a 4x4 list of single character strings.
-    """
-
+# Lists of lists, each one representing a dice, for each size of board.
+DICE = {
     # The 16 die used in Boggle have the following 96 letters on their faces.
     # reference: http://everything2.com/title/Boggle
-
-    die = [
+    4: [
         ["A", "E", "A", "N", "E", "G"],  ["W", "N", "G", "E", "E", "H"],
         ["A", "H", "S", "P", "C", "O"],  ["L", "N", "H", "N", "R", "Z"],
         ["A", "S", "P", "F", "F", "K"],  ["T", "S", "T", "I", "Y", "D"],
@@ -21,31 +17,131 @@ def board():
         ["R", "Y", "V", "D", "E", "L"],  ["T", "O", "E", "S", "S", "I"],
         ["L", "R", "E", "I", "X", "D"],  ["T", "E", "R", "W", "H", "V"],
         ["E", "I", "U", "N", "E", "S"],  ["N", "U", "I", "H", "M", "S"]
-    ]
-
-    # first we will build a list in which each element is one face of the die
-    # from the 16x6 list of lists above
-    faces = []
-    for i in range(16):
-        # choose a random die
-        dice = random.choice(die)
-        # choose a random face from that die
-        face = random.choice(dice)
-        # take that die out of the list
-        die.remove(dice)
-        # Add the face to the die that will go on the board.
-        faces.append(face)
-
-    # Next break the 16 elements in the faces list into a 4x4 list
-    # This will represent the randomly generated board used to play the game.
-    board = []
-    i = 0
-    for row in range(4):
-        board.append([])
-        for column in range(4):
-            board[row].append(faces[i])
-            i += 1
-    return board
+    ],
+    # The 25 die used in Big Boggle.
+    5: [list(faces) for faces in [
+        "AAAFRS", "AAEEEE", "AAFIRS", "ADENNN", "AEEEEM",
+        "AEEGMU", "AEGMNN", "AFIRSY", "BJKQXZ", "CCNSTW",
+        "CEIILT", "CEILPT", "CEIPST", "DDLNOR", "DHHLOR",
+        "DHHNOT", "DHLNOR", "EIIITT", "EMOTTT", "ENSSSU",
+        "FIPRSY", "GORRVW", "HIPRRY", "NOOTUW", "OOOTTU"
+    ]],
+    # The 36 die used in Super Big Boggle. Each face of a board holds a
+    # single letter, so the die with two letter faces (AN ER HE IN QU TH)
+    # uses their first letters, and the blank faces of EIO### are vowels.
+    6: [list(faces) for faces in [
+        "AAAFRS", "AAEEEE", "AAEEOO", "AAFIRS", "ABDEIO", "ADENNN",
+        "AEEEEM", "AEEGMU", "AEGMNN", "AEILMN", "AEINOU", "AFIRSY",
+        "AEHIQT", "BBJKXZ", "CCENST", "CDDLNN", "CEIITT", "CEIPST",
+        "CFGNUY", "DDHNOT", "DHHLOR", "DHHNOW", "DHLNOR", "EHILRS",
+        "EIILST", "EILPST", "EIOAEI", "EMTTTO", "ENSSSU", "GORRVW",
+        "HIRSTV", "HOPRST", "IPRSYY", "JKQWXZ", "NOOTUW", "OOOTTU"
+    ]],
+}
+
+BOARD_SIZES = sorted(DICE)
+
+
+def roll(size=4, rng=random):
+    """Shakes the dice for a size x size board, and returns the board's id.
+
+    A board is identified by the order the dice are placed in and the face
+    each die shows, combined into one integer: the rank of the order among
+    all orders of the dice, times 6**(size*size), plus the faces as a base 6
+    number. The same id always decodes to the same board, see
+    board_from_id().
+
+    Args:
+        size: one of BOARD_SIZES
+        rng: the source of randomness, a random.Random instance or the
+            random module itself.
+    """
+    n = size * size
+    order = range(n)
+    rng.shuffle(order)
+    faces = [int(rng.random() * 6) for i in range(n)]
+    return board_id(order, faces)
+
+
+def board_id(order, faces):
+    """Returns the id of a board, see roll()
+    Args:
+        order: a permutation of the indices of the dice
+        faces: the index of the face shown by each die, in board order
+    """
+    # The rank of the order, by the factorial number system
+    rank = 0
+    remaining = sorted(order)
+    for die in order:
+        i = remaining.index(die)
+        rank = rank * len(remaining) + i
+        remaining.pop(i)
+    shown = 0
+    for face in reversed(faces):
+        shown = shown * 6 + face
+    return rank * 6 ** len(faces) + shown
+
+
+def board_from_id(board_id, size=4):
+    """Returns the size x size list of single character strings identified
+    by board_id, see roll()"""
+    n = size * size
+    rank, shown = divmod(board_id, 6 ** n)
+    digits = []
+    for base in range(1, n + 1):
+        rank, digit = divmod(rank, base)
+        digits.append(digit)
+    remaining = range(n)
+    order = [remaining.pop(d) for d in reversed(digits)]
+    letters = []
+    for die in order:
+        shown, face = divmod(shown, 6)
+        letters.append(DICE[size][die][face])
+    return decode_board(''.join(letters), size)
+
+
+def board(size=4, seed=None):
+    """Returns a size x size list of single character strings.
+    Args:
+        size: one of BOARD_SIZES
+        seed: if given, the same seed always produces the same board.
+    """
+    rng = random if seed is None else random.Random(seed)
+    return board_from_id(roll(size, rng), size)
+
+
+def boards(count, size=4, seed=None):
+    """Returns a list of count (board id, board) tuples, generated from a
+    single random number generator. Faster than calling board() count times.
+    """
+    rng = random.Random(seed)
+    dice = DICE[size]
+    n = size * size
+    result = []
+    for i in range(count):
+        order = range(n)
+        rng.shuffle(order)
+        faces = [int(rng.random() * 6) for j in range(n)]
+        letters = ''.join([dice[die][face]
+                           for die, face in zip(order, faces)])
+        result.append((board_id(order, faces), decode_board(letters, size)))
+    return result
+
+
+def encode_board(board):
+    """Returns a board as a string of its letters, row by row. Used to store
+    boards compactly in models.Game
+    Args:
+        board: an NxN list of single character strings.
+    """
+    return ''.join(''.join(row) for row in board)
+
+
+def decode_board(letters, size):
+    """Returns the NxN list of single character strings encoded by
+    encode_board()"""
+    return [list(letters[row * size:(row + 1) * size])
+            for row in range(size)]
 
 
 def find_in_row(letter, row):
@@ -65,7 +161,7 @@ def find_letter(letter, board):
     """Returns a list of coordinates for a letter located in a board.
     Args:
         letter: a string
-        board:  a 4x4 list of single character strings.
+        board:  an NxN list of single character strings.
     """
     coords = []
     # iterate over rows
@@ -78,14 +174,11 @@ def find_letter(letter, board):
 
 
 def find_letters(word, board):
-    """This function is used by models.Game.check_word(), as an input for
-    the all_paths() function defined below.
-
-    Returns a dict, with coordinates of each letter in the word.
+    """Returns a dict, with coordinates of each letter in the word.
 
     Args:
         word: a string
-        board: a 4x4 list of strings
+        board: an NxN list of strings
     """
     path = dict()
     for letter in word:
@@ -110,58 +203,75 @@ def is_adjacent(c1, c2):
     return True
 
 
-def path_test(path):
-    """Determines if a list of coordinates can be traversed without requiring
-    any non-adjacent moves.
-    Args:
-        path: a list of 2-dim coordinate tuples
-    Returns: Boolean value
+def neighbours(size):
+    """Builds the neighbour table for a size x size board.
+
+    Cells are numbered row by row, so the cell at coordinate (x, y) has the
+    index y*size + x. Returns a list in which element i is the list of cell
+    indices adjacent to cell i.
     """
-    for index, coord in enumerate(path):
-        if index >= len(path)-1:
-            # We've reached the end of the path without issue
-            return True
-        # check that the path doesn't cross itself (no repeated coords)
-        if coord in path[index+1:]:
-            return False
-        next_coord = path[index+1]
-        if not is_adjacent(coord, next_coord):
-            return False
+    coords = [(i % size, i // size) for i in range(size * size)]
+    return [[j for j, c2 in enumerate(coords) if is_adjacent(c1, c2)]
+            for c1 in coords]
+
+
+# The neighbour tables, by board size, are only computed once, when the
+# module is imported.
+NEIGHBOURS = dict((size, neighbours(size)) for size in BOARD_SIZES)
 
 
-def all_paths(word, word_coords):
-    """Given a word, and the coordinates of the letters in that word in a
-    board, find all possible paths through those coordinates, and then run
-    path_test() on each. If any path is valid, return True.
+def find_path(word, board):
+    """Searches the board for a path which spells the word.
 
     This function is used in models.Game.check_word()
 
+    A depth first search is started from each cell holding the first letter
+    of the word. Cells already used in the path are tracked with a bitmask,
+    and a branch is abandoned as soon as no unused neighbour holds the next
+    letter. Words needing more of a letter than the board has are rejected
+    before searching, and if the last letter is rarer on the board than the
+    first, the word is searched for from its end instead, since a path can
+    be followed in either direction.
+
     Args:
         word: the word we are checking for
-        word_coords: the dict of letters and their coordinates.
+        board: an NxN list of single character strings.
+    Returns:
+        A list of (x, y) coordinate tuples, or None if the word can't be
+        found on the board.
     """
-    options = []
-    # Use the word to traverse the dict
-    for letter in word:
-        # Using the code in list_games.py, create a new function to
-        # build an "options list" by counting coords for each word
-        options.append(len(word_coords[letter]))
-    print options
-    # For each item in the options list,
-    # create a list of each posible path through the coords
-    paths = [[]]
-    for letter in word:
-        new_paths = []
-        for i in range(len(paths)):
-            for j in range(len(word_coords[letter])):
-                new_paths.append(paths[i]+[word_coords[letter][j]])
-        paths = new_paths
-    # check each path until one is found valid
-    for path in paths:
-        print "testing path: %s" % path
-        if path_test(path):
-            return True
-    return False
+    cells = [letter for row in board for letter in row]
+    size = len(board)
+    table = NEIGHBOURS[size]
+    if not word or len(word) > len(cells):
+        return None
+    for letter in set(word):
+        if word.count(letter) > cells.count(letter):
+            return None
+    reverse = cells.count(word[-1]) < cells.count(word[0])
+    if reverse:
+        word = word[::-1]
+
+    def search(index, depth, visited):
+        # cell 'index' matches word[depth], and has been added to 'visited'
+        if depth == len(word) - 1:
+            return [index]
+        letter = word[depth + 1]
+        for n in table[index]:
+            if cells[n] == letter and not visited & (1 << n):
+                path = search(n, depth + 1, visited | (1 << n))
+                if path is not None:
+                    return [index] + path
+        return None
+
+    for start, letter in enumerate(cells):
+        if letter == word[0]:
+            path = search(start, 0, 1 << start)
+            if path is not None:
+                if reverse:
+                    path.reverse()
+                return [(i % size, i // size) for i in path]
+    return None
 
 
 def word_points(word):
@@ -0,0 +1,47 @@
+"""cache.py - This file contains a small in-process cache, used in front of
+memcache for values which are read far more often than they change."""
+
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """A thread safe, bounded cache which evicts the least recently used
+    entry when it is full. Each entry can have its own time to live."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the cached value, or default if the key is missing or
+        has expired."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                return default
+            # re-insert the entry to mark it as the most recently used
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Caches the value for ttl seconds, or until it is evicted if ttl
+        is None."""
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
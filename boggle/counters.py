@@ -0,0 +1,101 @@
+"""counters.py - This file contains sharded counters, used to keep running
+totals which many requests update at once, such as the number of open games.
+
+Each counter is split across a number of shard entities. An update changes
+one shard chosen at random, so concurrent updates rarely touch the same
+entity, and the total is the sum of the shards.
+
+A shard is its own entity group, which sustains about one transactional
+write a second, so a counter takes about as many updates a second as it has
+shards before updates start to collide and their transactions are retried.
+TURNS_REMAINING is updated by every move, so it has TURNS_SHARDS shards,
+enough for that many moves a second across the app. The other counters only
+change once or twice per game, and have NUM_SHARDS, which keeps reading
+them cheap.
+"""
+
+import random
+
+from google.appengine.ext import ndb
+
+
+NUM_SHARDS = 20
+TURNS_SHARDS = 200
+
+# The counters kept by the app
+OPEN_GAMES = 'open_games'
+TURNS_REMAINING = 'turns_remaining'
+
+
+def board_pool(size):
+    """Returns the name of the counter of pooled boards of the given size"""
+    return 'board_pool_{}'.format(size)
+
+
+class CounterShard(ndb.Model):
+    """One shard of a named counter"""
+    count = ndb.IntegerProperty(required=True, default=0, indexed=False)
+
+
+def _num_shards(name):
+    return TURNS_SHARDS if name == TURNS_REMAINING else NUM_SHARDS
+
+
+def _shard_keys(name):
+    return [ndb.Key(CounterShard, '{}-{}'.format(name, i))
+            for i in range(_num_shards(name))]
+
+
+@ndb.tasklet
+def increment_async(name, delta=1):
+    """Adds delta to the named counter. Call this inside the transaction
+    which makes the change being counted, so that the counter is only
+    updated if the change is committed."""
+    if not delta:
+        return
+    key = random.choice(_shard_keys(name))
+    shard = yield key.get_async()
+    if shard is None:
+        shard = CounterShard(key=key)
+    shard.count += delta
+    yield shard.put_async()
+
+
+@ndb.tasklet
+def get_totals_async(names):
+    """Returns a dict of the totals of the named counters, read with one
+    batch get."""
+    keys = []
+    for name in names:
+        keys += _shard_keys(name)
+    shards = yield ndb.get_multi_async(keys)
+    totals = {}
+    start = 0
+    for name in names:
+        end = start + _num_shards(name)
+        totals[name] = sum(shard.count for shard in shards[start:end]
+                           if shard)
+        start = end
+    raise ndb.Return(totals)
+
+
+def set_total(name, total):
+    """Corrects the named counter, so that its total is the given value.
+    Used to reconcile a counter with the data it counts. Returns the total
+    before the correction.
+
+    A transaction can't span every shard, so the shards are read outside
+    one, and the difference is added to a single shard in a transaction. An
+    update made in between is no more out of date than the total, which was
+    counted before this was called."""
+    current = get_totals_async([name]).get_result()[name]
+    if current != total:
+        key = _shard_keys(name)[0]
+
+        @ndb.transactional
+        def correct():
+            shard = key.get() or CounterShard(key=key)
+            shard.count += total - current
+            shard.put()
+        correct()
+    return current
@@ -0,0 +1,224 @@
+"""dictionary.py - This file contains the local dictionary, which answers
+"is this a word" and "is this the start of a word" without calling an
+outside service.
+
+The dictionary is a sorted list of upper case words, packed into a single
+file which is memory-mapped when it is opened, so nothing has to be parsed
+when an instance starts. The file is built from a plain text word list:
+
+    python dictionary.py build words.txt words.dict
+
+and a cold-start and lookup benchmark can be run against it with:
+
+    python dictionary.py bench words.dict
+
+File layout (all integers are unsigned 32 bit, little endian):
+    header:  magic (8 bytes), word count (N), length of the word data
+    offsets: N+1 integers, the start of each word in the word data
+    index:   27 integers, the first word starting with each letter A-Z,
+             then N. Followed by 26*26+1 integers, the first word starting
+             with each two letter prefix AA-ZZ, then N.
+    words:   the words, concatenated in sorted order
+"""
+
+import bisect
+import os
+import struct
+import sys
+import time
+
+try:
+    import mmap
+except ImportError:
+    # mmap isn't available in the App Engine sandbox. The file is read into
+    # memory instead, which is still fast since nothing needs parsing.
+    mmap = None
+
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(__file__), 'words.dict')
+
+MAGIC = 'BOGDICT1'
+HEADER = struct.Struct('<8sII')
+UINT = struct.Struct('<I')
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def _prefixes():
+    """Returns the single and two letter prefixes covered by the index, in
+    the order they are stored."""
+    singles = list(LETTERS)
+    pairs = [a + b for a in LETTERS for b in LETTERS]
+    return singles, pairs
+
+
+def build(words, path):
+    """Writes a dictionary file.
+    Args:
+        words: an iterable of strings. Words are upper cased, and words with
+            non alphabetic characters are skipped.
+        path: the file to write.
+    """
+    words = sorted(set(w.strip().upper() for w in words
+                       if w.strip().isalpha()))
+    offsets = []
+    position = 0
+    for word in words:
+        offsets.append(position)
+        position += len(word)
+    offsets.append(position)
+    singles, pairs = _prefixes()
+    index = [bisect.bisect_left(words, p) for p in singles] + [len(words)]
+    index += [bisect.bisect_left(words, p) for p in pairs] + [len(words)]
+    with open(path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, len(words), position))
+        out.write(struct.pack('<%dI' % len(offsets), *offsets))
+        out.write(struct.pack('<%dI' % len(index), *index))
+        out.write(''.join(words))
+
+
+class Dictionary(object):
+    """A read only, memory-mapped dictionary file.
+
+    Words are identified by their position in the sorted word list. A range
+    (lo, hi) is the words from position lo up to, but not including, hi.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if mmap is not None:
+                self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buf = f.read()
+        magic, self.count, length = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a dictionary file' % path)
+        self._offsets = HEADER.size
+        self._index = self._offsets + UINT.size * (self.count + 1)
+        self._words = self._index + UINT.size * (27 + 26 * 26 + 1)
+
+    def __len__(self):
+        return self.count
+
+    def _int(self, position):
+        return UINT.unpack_from(self._buf, position)[0]
+
+    def word(self, i):
+        """Returns the word at position i"""
+        start = self._int(self._offsets + UINT.size * i)
+        end = self._int(self._offsets + UINT.size * (i + 1))
+        return self._buf[self._words + start:self._words + end]
+
+    def letter(self, i, depth):
+        """Returns the letter of word i at position depth, or '' if the word
+        is too short."""
+        start = self._int(self._offsets + UINT.size * i)
+        end = self._int(self._offsets + UINT.size * (i + 1))
+        if depth >= end - start:
+            return ''
+        position = self._words + start + depth
+        return self._buf[position:position + 1]
+
+    def prefix_range(self, prefix):
+        """Returns the range of words which start with the first one or two
+        letters of the prefix, using the index."""
+        if not prefix:
+            return 0, self.count
+        first = LETTERS.find(prefix[0])
+        if first < 0:
+            return 0, 0
+        if len(prefix) == 1:
+            position = self._index + UINT.size * first
+            return self._int(position), self._int(position + UINT.size)
+        second = LETTERS.find(prefix[1])
+        if second < 0:
+            return 0, 0
+        position = self._index + UINT.size * (27 + first * 26 + second)
+        return self._int(position), self._int(position + UINT.size)
+
+    def _bisect(self, word, lo, hi):
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.word(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def is_word(self, word):
+        """Returns True if the upper case word is in the dictionary"""
+        lo, hi = self.prefix_range(word)
+        i = self._bisect(word, lo, hi)
+        return i < hi and self.word(i) == word
+
+    def is_prefix(self, prefix):
+        """Returns True if any word in the dictionary starts with the upper
+        case prefix. Complete words count as their own prefix."""
+        lo, hi = self.prefix_range(prefix)
+        i = self._bisect(prefix, lo, hi)
+        return i < hi and self.word(i).startswith(prefix)
+
+    def narrow(self, lo, hi, depth, letter):
+        """Given a range of words which all share their first 'depth'
+        letters, returns the part of that range whose next letter is
+        'letter'. Used by the board solver to follow a prefix one letter at a
+        time.
+        """
+        # Words in the range are sorted by the letter at 'depth', with words
+        # that are only 'depth' letters long first.
+        def first(lo, hi, target):
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.letter(mid, depth) < target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+        start = first(lo, hi, letter)
+        return start, first(start, hi, chr(ord(letter) + 1))
+
+
+_dictionary = None
+
+
+def get_dictionary():
+    """Returns the deployed dictionary, or None if there is no dictionary
+    file. The file is opened once per instance."""
+    global _dictionary
+    if _dictionary is None and os.path.exists(DICTIONARY_PATH):
+        _dictionary = Dictionary(DICTIONARY_PATH)
+    return _dictionary
+
+
+def _bench(path, lookups=100000):
+    """Prints the time taken to open the dictionary, and the average time of
+    word and prefix lookups."""
+    start = time.time()
+    dictionary = Dictionary(path)
+    print 'open: {:.3f} ms ({} words)'.format(
+        (time.time() - start) * 1000, len(dictionary))
+    step = max(1, len(dictionary) // lookups)
+    words = [dictionary.word(i) for i in range(0, len(dictionary), step)]
+    misses = [w[::-1] + 'Q' for w in words]
+    prefixes = [w[:max(1, len(w) // 2)] for w in words]
+    for name, check, samples in (('is_word (hit)', dictionary.is_word, words),
+                                 ('is_word (miss)', dictionary.is_word,
+                                  misses),
+                                 ('is_prefix', dictionary.is_prefix,
+                                  prefixes)):
+        start = time.time()
+        for sample in samples:
+            check(sample)
+        print '{}: {:.2f} us'.format(
+            name, (time.time() - start) / len(samples) * 1e6)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'build':
+        with open(sys.argv[2]) as word_list:
+            build(word_list, sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == 'bench':
+        _bench(sys.argv[2])
+    else:
+        print 'usage: python dictionary.py build WORD_LIST OUTPUT'
+        print '       python dictionary.py bench DICTIONARY'
+        sys.exit(2)
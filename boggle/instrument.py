@@ -0,0 +1,191 @@
+"""instrument.py - This file contains the instrumentation of requests: how
+long each request and each phase of it takes, and which RPCs it makes.
+
+Every BoggleApi method is wrapped with instrumented(), and the handlers in
+main.py with middleware(). Code inside a request marks its phases, such as
+the dictionary lookup or the board check, with phase(). RPCs are counted,
+and urlfetch calls timed, by hooks on the apiproxy, so ndb's gets, puts and
+queries are all seen without changing the code that makes them.
+
+When a request finishes its durations are added to histograms, and its RPC
+counts to counters, with metrics.py, which only writes to memcache every
+few seconds. The totals are served by /admin/stats. One request in
+LOG_SAMPLE_RATE, and every request slower than SLOW_REQUEST_MS, is also
+logged as a line of JSON.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+import metrics
+
+
+LOG_SAMPLE_RATE = 0.01
+SLOW_REQUEST_MS = 1000
+
+# The phases marked with phase(), and timed urlfetch calls
+PHASES = ['dictionary', 'board_check', 'transaction', 'urlfetch']
+# The RPCs whose counts are reported by /admin/stats, as service.call
+RPCS = ['datastore_v3.Get', 'datastore_v3.Put', 'datastore_v3.Delete',
+        'datastore_v3.RunQuery', 'datastore_v3.Next', 'datastore_v3.Commit',
+        'memcache.Get', 'memcache.Set', 'urlfetch.Fetch']
+
+# The names of the instrumented requests
+REQUESTS = []
+
+_local = threading.local()
+
+
+def _current():
+    return getattr(_local, 'state', None)
+
+
+def _pre_call(service, call, request, response, rpc):
+    state = _current()
+    if state is None:
+        return
+    name = service + '.' + call
+    state['rpcs'][name] = state['rpcs'].get(name, 0) + 1
+    if service == 'urlfetch' and rpc is not None:
+        state['fetches'][id(rpc)] = time.time()
+
+
+def _post_call(service, call, request, response, rpc, error):
+    state = _current()
+    if state is None or service != 'urlfetch' or rpc is None:
+        return
+    start = state['fetches'].pop(id(rpc), None)
+    if start is not None:
+        _add_phase(state, 'urlfetch', (time.time() - start) * 1000)
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('instrument', _pre_call)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('instrument', _post_call)
+
+
+def _add_phase(state, name, ms):
+    state['phases'][name] = state['phases'].get(name, 0) + ms
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Times the enclosed code as the named phase of the current request.
+    Phases which run more than once in a request are added up."""
+    state = _current()
+    start = time.time()
+    try:
+        yield
+    finally:
+        if state is not None:
+            _add_phase(state, name, (time.time() - start) * 1000)
+
+
+@contextlib.contextmanager
+def request(name):
+    """Instruments the enclosed code as one request with the given name"""
+    _local.state = {'phases': {}, 'rpcs': {}, 'fetches': {}}
+    start = time.time()
+    status = 'ok'
+    try:
+        yield
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        state = _local.state
+        _local.state = None
+        _record(name, status, (time.time() - start) * 1000, state)
+
+
+def _record(name, status, ms, state):
+    metrics.histogram('request.' + name, ms)
+    if status != 'ok':
+        metrics.incr('request.{}.errors'.format(name))
+    for phase_name, phase_ms in state['phases'].items():
+        metrics.histogram('phase.' + phase_name, phase_ms)
+        metrics.timing('phase.{}.{}'.format(name, phase_name), phase_ms)
+    for rpc, count in state['rpcs'].items():
+        metrics.incr('rpc.{}.{}'.format(name, rpc), count)
+    if ms >= SLOW_REQUEST_MS or random.random() < LOG_SAMPLE_RATE:
+        logging.info('request_stats %s', json.dumps({
+            'request': name,
+            'status': status,
+            'ms': round(ms, 1),
+            'phases': dict((k, round(v, 1))
+                           for k, v in state['phases'].items()),
+            'rpcs': state['rpcs'],
+        }, sort_keys=True))
+
+
+def instrumented(method):
+    """Decorates a BoggleApi method, instrumenting each call as a request
+    named after the method."""
+    REQUESTS.append(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with request(method.__name__):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def middleware(app, paths):
+    """Wraps a WSGI application, instrumenting each request as a request
+    named after its path.
+    Args:
+        app: the WSGI application
+        paths: the paths the application serves, reported by /admin/stats
+    """
+    REQUESTS.extend(paths)
+
+    def wrapper(environ, start_response):
+        with request(environ.get('PATH_INFO', '')):
+            return app(environ, start_response)
+    return wrapper
+
+
+def report():
+    """Returns the flushed totals of the instrumented requests, and the
+    histograms of each phase across all requests"""
+    names = ['request.' + name for name in REQUESTS]
+    histograms = metrics.histogram_totals(names)
+    counters = []
+    for name in REQUESTS:
+        counters.append('request.{}.errors'.format(name))
+        counters += ['phase.{}.{}.{}'.format(name, phase_name, total)
+                     for phase_name in PHASES
+                     for total in ('count', 'total')]
+        counters += ['rpc.{}.{}'.format(name, rpc) for rpc in RPCS]
+    counts = metrics.totals(counters)
+
+    requests = {}
+    for name in REQUESTS:
+        stats = histograms.get('request.' + name)
+        if stats is None:
+            continue
+        count = stats['count']
+        stats['errors'] = counts['request.{}.errors'.format(name)]
+        stats['phases_mean_ms'] = dict(
+            (phase_name, round(float(counts['phase.{}.{}.total'.format(
+                name, phase_name)]) / count, 1))
+            for phase_name in PHASES
+            if counts['phase.{}.{}.count'.format(name, phase_name)])
+        stats['rpcs_per_request'] = dict(
+            (rpc, round(float(counts['rpc.{}.{}'.format(name, rpc)]) / count,
+                        2))
+            for rpc in RPCS if counts['rpc.{}.{}'.format(name, rpc)])
+        requests[name] = stats
+    phases = metrics.histogram_totals(
+        ['phase.' + phase_name for phase_name in PHASES])
+    return {
+        'requests': requests,
+        'phases': dict((name[len('phase.'):], stats)
+                       for name, stats in phases.items()),
+    }
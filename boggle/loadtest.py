@@ -0,0 +1,270 @@
+"""loadtest.py - This file contains a load test which runs the BoggleApi
+in-process, against the App Engine testbed's datastore, memcache and task
+queue stubs, without deploying.
+
+The dictionary service is replaced by a fake urlfetch which answers from a
+local word list, one word per line. The test plays many two player games at
+once, interleaving their requests: users are created, games are started,
+players take turns with make_move, and some games are cancelled part way.
+It then reports the p50/p95/p99 latency of each endpoint, and the average
+number of datastore and memcache calls each request made.
+
+    python loadtest.py --sdk ~/google-cloud-sdk/platform/google_appengine \\
+        --words words.txt --games 1000
+
+Games are interleaved in one thread, so the latencies are those of single
+requests against the stubs, not of a loaded instance. They are meant for
+comparing changes with each other.
+"""
+
+import argparse
+from collections import defaultdict
+import json
+import math
+import os
+import random
+import sys
+import time
+import urlparse
+
+
+GUESSES_PER_GAME = 200
+# The number of get_user_rankings requests made once the games are over
+RANKINGS_REQUESTS = 100
+
+
+def percentile(values, p):
+    """Returns the p'th percentile of a sorted list, by nearest rank"""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(len(values) - 1, rank))]
+
+
+class Recorder(object):
+    """Collects the latency, and the number of calls to each service, of
+    every request made by the load test."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.calls = defaultdict(lambda: defaultdict(int))
+        self._current = None
+
+    def hook(self, service, call, request, response, rpc=None):
+        """An apiproxy pre-call hook, counting calls by service"""
+        if self._current is not None:
+            self.calls[self._current][service] += 1
+
+    def call(self, endpoint, method, request):
+        """Calls an endpoint method, recording its latency and calls. Errors
+        raised by the endpoint are recorded as responses too."""
+        import endpoints
+        from google.appengine.ext import ndb
+        # Each request starts with an empty context cache, as on App Engine
+        ndb.get_context().clear_cache()
+        self._current = endpoint
+        start = time.time()
+        try:
+            return method(request)
+        except endpoints.ServiceException:
+            return None
+        finally:
+            self.latencies[endpoint].append((time.time() - start) * 1000)
+            self._current = None
+
+    def report(self):
+        """Returns a dict of the statistics of each endpoint"""
+        results = {}
+        for endpoint, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            requests = len(latencies)
+            calls = self.calls[endpoint]
+            results[endpoint] = {
+                'requests': requests,
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'datastore_calls': round(
+                    float(calls['datastore_v3']) / requests, 2),
+                'memcache_calls': round(
+                    float(calls['memcache']) / requests, 2),
+                'urlfetch_calls': round(
+                    float(calls['urlfetch']) / requests, 2),
+            }
+        return results
+
+
+def fake_urlfetch_stub(words):
+    """Returns a urlfetch stub which answers Merriam-Webster lookups from a
+    set of upper case words, see lookup.py"""
+    from google.appengine.api import apiproxy_stub
+
+    class FakeURLFetch(apiproxy_stub.APIProxyStub):
+        def __init__(self):
+            super(FakeURLFetch, self).__init__('urlfetch')
+
+        def _Dynamic_Fetch(self, request, response):
+            path = urlparse.urlparse(request.url()).path
+            word = path.rsplit('/', 1)[-1].upper()
+            if word in words:
+                content = '<entry_list><entry id="{}"/></entry_list>'.format(
+                    word.lower())
+            else:
+                content = '<entry_list></entry_list>'
+            response.set_content(content)
+            response.set_statuscode(200)
+
+    return FakeURLFetch()
+
+
+def setup(sdk, words):
+    """Activates a testbed with the stubs the API needs, and returns it"""
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    # The endpoints server reads the version, as on App Engine
+    bed.setup_env(app_id='boggle-game', current_version_id='1.1',
+                  overwrite=True)
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=os.path.dirname(
+        os.path.abspath(__file__)))
+    bed.init_app_identity_stub()
+    apiproxy_stub_map.apiproxy.RegisterStub('urlfetch',
+                                            fake_urlfetch_stub(words))
+    return bed
+
+
+def board_words(game, words, rng, count=GUESSES_PER_GAME):
+    """Returns guesses for a game: a mix of words on its board, words that
+    aren't, and words that aren't english."""
+    import boggle
+    grid = game.grid()
+    on_board = [word for word in rng.sample(words, min(len(words), 5000))
+                if boggle.find_path(word, grid) is not None]
+    guesses = on_board[:count // 2]
+    guesses += rng.sample(words, min(len(words), count // 4))
+    guesses += [''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+                        for i in range(5)) for j in range(count // 4)]
+    rng.shuffle(guesses)
+    return guesses
+
+
+def run(games, turns, words, cancel_rate, seed):
+    """Plays the games and returns the Recorder"""
+    from google.appengine.api import apiproxy_stub_map
+    import api
+    from utils import get_by_urlsafe
+
+    rng = random.Random(seed)
+    word_list = sorted(words)
+    recorder = Recorder()
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('loadtest',
+                                                        recorder.hook)
+    service = api.BoggleApi()
+
+    for i in range(games * 2):
+        recorder.call('create_user', service.create_user,
+                      api.USER_REQUEST.combined_message_class(
+                          user_name='player{}'.format(i),
+                          email='player{}@example.com'.format(i)))
+
+    active = []
+    for i in range(games):
+        names = ['player{}'.format(2 * i), 'player{}'.format(2 * i + 1)]
+        form = recorder.call('new_game', service.new_game,
+                             api.NEW_GAME_REQUEST.combined_message_class(
+                                 user1_name=names[0], user2_name=names[1],
+                                 turns=turns))
+        if form is None:
+            continue
+        game = get_by_urlsafe(form.urlsafe_key, api.Game)
+        active.append({'key': form.urlsafe_key,
+                       'names': names,
+                       'next': 0,
+                       'guesses': board_words(game, word_list, rng)})
+
+    # Take one turn in each game in turn, so that many games are in play at
+    # once, until they are all over.
+    while active:
+        still_active = []
+        for game in active:
+            player = game['names'][game['next']]
+            if rng.random() < cancel_rate:
+                recorder.call('cancel_game', service.cancel_game,
+                              api.CANCEL_GAME_REQUEST.combined_message_class(
+                                  urlsafe_game_key=game['key'],
+                                  user_name=player))
+                continue
+            guess = (game['guesses'].pop() if game['guesses'] else
+                     rng.choice(word_list))
+            form = recorder.call('make_move', service.make_move,
+                                 api.MAKE_MOVE_REQUEST.combined_message_class(
+                                     urlsafe_game_key=game['key'],
+                                     user_name=player,
+                                     guess=guess))
+            game['next'] = 1 - game['next']
+            if form is not None and not form.game_over:
+                still_active.append(game)
+        active = still_active
+
+    for i in range(RANKINGS_REQUESTS):
+        recorder.call('get_user_rankings', service.get_user_rankings,
+                      api.RANKINGS_REQUEST.combined_message_class())
+    return recorder
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Load test the BoggleApi in-process against stubs.')
+    parser.add_argument('--sdk', required=True,
+                        help='the google_appengine SDK directory')
+    parser.add_argument('--words', required=True,
+                        help='a word list for the fake dictionary service')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--cancel-rate', type=float, default=0.01,
+                        help='the chance a player cancels instead of moving')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    with open(args.words) as f:
+        words = set(line.strip().upper() for line in f
+                    if line.strip().isalpha())
+    bed = setup(args.sdk, words)
+    try:
+        start = time.time()
+        recorder = run(args.games, args.turns, words, args.cancel_rate,
+                       args.seed)
+        elapsed = time.time() - start
+    finally:
+        bed.deactivate()
+
+    results = recorder.report()
+    print '{:<18} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>10}'.format(
+        'endpoint', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'datastore',
+        'memcache', 'urlfetch')
+    for endpoint in sorted(results):
+        r = results[endpoint]
+        print '{:<18} {:>8} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.2f} {:>10.2f} ' \
+              '{:>10.2f}'.format(endpoint, r['requests'], r['p50_ms'],
+                                 r['p95_ms'], r['p99_ms'],
+                                 r['datastore_calls'], r['memcache_calls'],
+                                 r['urlfetch_calls'])
+    print 'total: {:.1f} s'.format(elapsed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, sort_keys=True, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,124 @@
+"""lookup.py - This file contains the Merriam-Webster dictionary lookup,
+and the cache in front of it.
+
+Results are cached by upper case word, first in a bounded in-process LRU
+and then in memcache. Words that aren't found are cached too, for a shorter
+time. When several requests ask about the same uncached word at once,
+only the first fetches it: it takes a short lease on the word with a
+memcache add, and the others poll memcache, sleeping between polls, until
+the result appears. Sleeping yields to the event loop, so a waiting
+request's other RPCs carry on meanwhile. If the result doesn't appear
+before the lease expires, the waiting request fetches the word itself.
+"""
+
+import time
+import xml.etree.ElementTree as ET
+
+from google.appengine.ext import ndb
+
+from cache import LRUCache
+import metrics
+
+
+DICTIONARY_URL = "http://www.dictionaryapi.com"\
+                 "/api/v1/references/collegiate/xml/{word}?key={key}"
+# I realize that publishing API keys on GitHub is bad practice,
+# but for the purposes of this project, the risks are minimal.
+DICTIONARY_KEY = 'a910e27f-cb8e-4d10-9a2d-b8bf3530c02d'
+
+LOCAL_CACHE_SIZE = 10000
+MEMCACHE_PREFIX = 'dictionary:'
+# Words rarely leave the dictionary, but a failed lookup is worth retrying
+# sooner.
+VALID_TTL = 7 * 24 * 60 * 60
+INVALID_TTL = 24 * 60 * 60
+LEASE_PREFIX = 'dictionary-lease:'
+# How long a request has to fetch a word before others stop waiting for it
+LEASE_TIME = 5
+POLL_INTERVAL = 0.1
+# The names of the counters kept by this module, see metrics.py
+COUNTERS = ['dictionary.local_hit', 'dictionary.memcache_hit',
+            'dictionary.shared_fetch', 'dictionary.miss']
+
+_local = LRUCache(LOCAL_CACHE_SIZE)
+
+
+def lookup_url(word):
+    return DICTIONARY_URL.format(word=word, key=DICTIONARY_KEY)
+
+
+def parse_is_word(content):
+    """Returns True if a Merriam-Webster API response contains an entry."""
+    # The Merriam-Webster API returns an XML string. If the word is found
+    # the XML will contain an <entry> tag.
+    # Use the ElementTree XML API module to look for the <entry> tag
+    parsed_xml = ET.fromstring(content)
+    return parsed_xml.find('entry') is not None
+
+
+@ndb.tasklet
+def fetch_is_word_async(word):
+    """Looks the upper case word up with the Merriam-Webster API, returning
+    True if it is found."""
+    result = yield ndb.get_context().urlfetch(lookup_url(word))
+    raise ndb.Return(parse_is_word(result.content))
+
+
+@ndb.tasklet
+def _fetch_and_store_async(word):
+    metrics.incr('dictionary.miss')
+    valid = yield fetch_is_word_async(word)
+    ttl = VALID_TTL if valid else INVALID_TTL
+    _local.set(word, valid, ttl)
+    yield ndb.get_context().memcache_set(MEMCACHE_PREFIX + word, int(valid),
+                                         time=ttl)
+    raise ndb.Return(valid)
+
+
+@ndb.tasklet
+def _memcache_get_async(word):
+    """Returns the result cached in memcache for the word, also caching it
+    in the LRU, or None if there is none."""
+    cached = yield ndb.get_context().memcache_get(MEMCACHE_PREFIX + word)
+    if cached is None:
+        raise ndb.Return(None)
+    valid = bool(cached)
+    _local.set(word, valid, VALID_TTL if valid else INVALID_TTL)
+    raise ndb.Return(valid)
+
+
+@ndb.tasklet
+def is_word_async(word):
+    """Returns True if the upper case word is in the Merriam-Webster
+    dictionary, using cached results where possible."""
+    valid = _local.get(word)
+    if valid is not None:
+        metrics.incr('dictionary.local_hit')
+        raise ndb.Return(valid)
+    context = ndb.get_context()
+    valid = yield _memcache_get_async(word)
+    if valid is not None:
+        metrics.incr('dictionary.memcache_hit')
+        raise ndb.Return(valid)
+
+    lease = LEASE_PREFIX + word
+    leased = yield context.memcache_add(lease, 1, time=LEASE_TIME)
+    if not leased:
+        # Another request is fetching the word
+        deadline = time.time() + LEASE_TIME
+        while time.time() < deadline:
+            yield ndb.sleep(POLL_INTERVAL)
+            valid = yield _memcache_get_async(word)
+            if valid is not None:
+                metrics.incr('dictionary.shared_fetch')
+                raise ndb.Return(valid)
+        # The other fetch failed or timed out, so try again here.
+    # The lease isn't released: once the result is stored nobody waits for
+    # it, and if the fetch fails it expires after LEASE_TIME.
+    valid = yield _fetch_and_store_async(word)
+    raise ndb.Return(valid)
+
+
+def is_word(word):
+    """Synchronous version of is_word_async"""
+    return is_word_async(word).get_result()
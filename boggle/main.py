@@ -3,85 +3,243 @@
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
 
-from google.appengine.api import (
-    mail,
-    app_identity
-)
+import datetime
+import json
+import logging
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 import webapp2
 
-from api import BoggleApi
+# The API's methods are imported so that /admin/stats can report them
+import api
+import archive
+from boggle import BOARD_SIZES
+import counters
+import instrument
+import lookup
+import metrics
+import migrations
 from models import (
     User,
     Game
 )
-from utils import games_and_users
+import pool
+import reminders
+from utils import TRANSACTION_COUNTERS
 
 
-class SendWaitingUserReminderEmail(webapp2.RequestHandler):
+class SendReminders(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User in an unfinished game.
-        Called every 3 hours using a cron job"""
-        app_id = app_identity.get_application_id()
+        """Email each User one digest of their unfinished games which have
+        changed since their last reminder. Called every hour using a cron
+        job. The digests are sent by tasks, see reminders.py"""
+        reminders.start()
+
+    def post(self):
+        """Send the digests for one shard of users"""
+        shard = self.request.get('shard')
+        sent = reminders.send_shard(
+            self.request.get('run'),
+            reminders.parse_cursor(self.request.get('start')),
+            reminders.parse_cursor(self.request.get('end')))
+        logging.info('Sent %d reminder digests for shard %s', sent, shard)
+        self.response.set_status(204)
 
-        games_list = games_and_users()
 
-        for game in games_list:
-            urlsafe_game_key, next_user, waiting_user = game
-            if waiting_user.email is None:
-                pass
-            else:
-                subject = 'Your game isn\'t over yet!'
-                body = '''Hello {a}, it\'s {b}\'s turn to find a word
-                        in the game: {c}. Your turn will be next!'''.format(
-                        a=waiting_user.name,
-                        b=next_user.name,
-                        c=urlsafe_game_key)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               user.email,
-                               subject,
-                               body)
-
-
-class SendNextUserReminderEmail(webapp2.RequestHandler):
+class QueueReminders(webapp2.RequestHandler):
+    def post(self):
+        """Queue a task for each shard of users, continuing with
+        another task if there are more shards than one task queues."""
+        run = self.request.get('run')
+        cursor = reminders.parse_cursor(self.request.get('cursor'))
+        shard = int(self.request.get('shard', 0))
+        next_cursor, shard = reminders.queue_shards(run, cursor, shard)
+        if next_cursor is not None:
+            taskqueue.add(url='/tasks/queue_reminders',
+                          params={'run': run,
+                                  'cursor': next_cursor.urlsafe(),
+                                  'shard': shard})
+        else:
+            logging.info('Queued %d shards of reminders', shard)
+        self.response.set_status(204)
+
+
+class ReconcileCounters(webapp2.RequestHandler):
+    def get(self):
+        """Start reconciling the open game counters with the games
+        themselves, correcting any drift. Called every 6 hours using a cron
+        job"""
+        taskqueue.add(url='/tasks/reconcile_counters')
+
+    def post(self):
+        """Count one page of open games, and either continue with the next
+        page or correct the counters."""
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        open_games = int(self.request.get('open_games', 0))
+        turns_remaining = int(self.request.get('turns_remaining', 0))
+        games, next_cursor, more = Game.query(
+            Game.game_over == False).fetch_page(500, start_cursor=cursor)
+        open_games += len(games)
+        turns_remaining += sum(game.turns_remaining for game in games)
+        if more:
+            taskqueue.add(url='/tasks/reconcile_counters',
+                          params={'cursor': next_cursor.urlsafe(),
+                                  'open_games': open_games,
+                                  'turns_remaining': turns_remaining})
+        else:
+            for name, total in ((counters.OPEN_GAMES, open_games),
+                                (counters.TURNS_REMAINING, turns_remaining)):
+                previous = counters.set_total(name, total)
+                if previous != total:
+                    logging.warning('Corrected counter %s from %d to %d',
+                                    name, previous, total)
+            for size in BOARD_SIZES:
+                name = counters.board_pool(size)
+                total = pool.count(size)
+                previous = counters.set_total(name, total)
+                if previous != total:
+                    logging.warning('Corrected counter %s from %d to %d',
+                                    name, previous, total)
+        self.response.set_status(204)
+
+
+class RefillBoardPool(webapp2.RequestHandler):
+    def get(self):
+        """Start topping up the board pool of every size. Called every hour
+        using a cron job, and new games queue a refill when the pool runs
+        low, see pool.py"""
+        for size in BOARD_SIZES:
+            pool.queue_refill(size)
+
+    def post(self):
+        """Add a batch of boards to the pool of one size, and continue with
+        another batch until the pool is full."""
+        size = int(self.request.get('size'))
+        added, total = pool.refill(size)
+        logging.info('Added %d boards to the %dx%d pool, which now has %d',
+                     added, size, size, total)
+        if not added:
+            logging.warning('No boards were added to the %dx%d pool, is the '
+                            'dictionary deployed?', size, size)
+        elif total < pool.HIGH_WATER_MARK:
+            taskqueue.add(url='/tasks/refill_board_pool',
+                          params={'size': size})
+        self.response.set_status(204)
+
+
+class ArchiveGames(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User who has the next turn in a game.
-        Called every hour using a cron job"""
-        app_id = app_identity.get_application_id()
-
-        # First find create a list of games that are not game over,
-        # and the player whose turn it is in each of those games
-        games_list = games_and_users()
-
-        for game in games_list:
-            urlsafe_game_key, next_user, waiting_user = game
-            if next_user.email is None:
-                pass
+        """Start ending idle games and archiving old finished games, see
+        archive.py. Called every day using a cron job"""
+        taskqueue.add(url='/tasks/archive_games',
+                      params={'started': time.time()})
+
+    def post(self):
+        """Run one page of the current job, and continue with the next page
+        or the next job. Each job logs how many games it handled and how
+        fast once it finishes."""
+        started = float(self.request.get('started'))
+        job = int(self.request.get('job', 0))
+        job_started = float(self.request.get('job_started', started))
+        handled = int(self.request.get('handled', 0))
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        name, run = archive.JOBS[job]
+        count, next_cursor = run(datetime.datetime.utcfromtimestamp(started),
+                                 cursor)
+        handled += count
+        params = {'started': started, 'job': job}
+        if next_cursor is not None:
+            params.update({'job_started': job_started,
+                           'handled': handled,
+                           'cursor': next_cursor.urlsafe()})
+        else:
+            elapsed = time.time() - job_started
+            logging.info('%s: %d games in %.1f s (%.1f games/s)', name,
+                         handled, elapsed, handled / max(elapsed, 0.001))
+            if job + 1 == len(archive.JOBS):
+                params = None
             else:
-                subject = 'It\'s your turn!'
-                body = '''Hello {a}, it\'s your turn to find a word
-                        in the game: {b}! {c} is waiting for you!'''.format(
-                        a=next_user.name,
-                        b=urlsafe_game_key,
-                        c=waiting_user.name)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               next_user.email,
-                               subject,
-                               body)
-
-
-class UpdateAverageMovesRemaining(webapp2.RequestHandler):
+                params.update({'job': job + 1, 'job_started': time.time()})
+        if params is not None:
+            taskqueue.add(url='/tasks/archive_games', params=params)
+        self.response.set_status(204)
+
+
+class MigrationHandler(webapp2.RequestHandler):
+    """Runs a job from migrations.py as a chain of tasks, one page of
+    entities per task. Visiting the handler's URL as an admin starts the
+    job."""
+    job = None
+
+    def get(self):
+        taskqueue.add(url=self.request.path)
+        self.response.write('Started {}'.format(self.request.path))
+
     def post(self):
-        """Update game listing announcement in memcache."""
-        BoggleApi._cache_average_turns()
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        next_cursor = self.job(cursor)
+        if next_cursor is not None:
+            taskqueue.add(url=self.request.path,
+                          params={'cursor': next_cursor.urlsafe()})
         self.response.set_status(204)
 
 
-app = webapp2.WSGIApplication([
-    ('/crons/send_waiting_reminder', SendWaitingUserReminderEmail),
-    ('/crons/send_next_reminder', SendNextUserReminderEmail),
-    ('/tasks/cache_average_turns', UpdateAverageMovesRemaining),
-], debug=True)
+class MigrateUserKeys(MigrationHandler):
+    job = staticmethod(migrations.migrate_user_keys)
+
+
+class BackfillGamePlayers(MigrationHandler):
+    job = staticmethod(migrations.backfill_game_players)
+
+
+class BackfillWinPercentage(MigrationHandler):
+    job = staticmethod(migrations.backfill_win_percentage)
+
+
+class BackfillGameUpdated(MigrationHandler):
+    job = staticmethod(migrations.backfill_game_updated)
+
+
+class MigrateGameEncoding(MigrationHandler):
+    job = staticmethod(migrations.migrate_game_encoding)
+
+
+class Stats(webapp2.RequestHandler):
+    def get(self):
+        """Returns the totals of the app's counters, and the latency
+        histograms, phase times and RPC counts of each API method and
+        handler, as JSON. Only admins can access this handler, see
+        app.yaml"""
+        metrics.flush()
+        self.response.headers['Content-Type'] = 'application/json'
+        counters = lookup.COUNTERS + TRANSACTION_COUNTERS
+        stats = instrument.report()
+        stats['counters'] = metrics.totals(counters)
+        self.response.write(json.dumps(stats, sort_keys=True))
+
+
+ROUTES = [
+    ('/crons/send_reminders', SendReminders),
+    ('/tasks/queue_reminders', QueueReminders),
+    ('/tasks/send_reminders', SendReminders),
+    ('/crons/reconcile_counters', ReconcileCounters),
+    ('/tasks/reconcile_counters', ReconcileCounters),
+    ('/crons/refill_board_pool', RefillBoardPool),
+    ('/tasks/refill_board_pool', RefillBoardPool),
+    ('/admin/stats', Stats),
+    ('/crons/archive_games', ArchiveGames),
+    ('/tasks/archive_games', ArchiveGames),
+    ('/tasks/migrate_user_keys', MigrateUserKeys),
+    ('/tasks/backfill_game_players', BackfillGamePlayers),
+    ('/tasks/backfill_win_percentage', BackfillWinPercentage),
+    ('/tasks/migrate_game_encoding', MigrateGameEncoding),
+    ('/tasks/backfill_game_updated', BackfillGameUpdated),
+]
+
+app = instrument.middleware(webapp2.WSGIApplication(ROUTES, debug=True),
+                            [path for path, handler in ROUTES])
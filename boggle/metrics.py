@@ -0,0 +1,99 @@
+"""metrics.py - This file contains simple counters, used to measure things
+like cache hit rates, and histograms of durations built from them.
+
+Counts are kept in process, and added to totals in memcache at most every
+FLUSH_INTERVAL seconds, so counting doesn't add an RPC to each request.
+"""
+
+import threading
+import time
+
+from google.appengine.api import memcache
+
+
+FLUSH_INTERVAL = 30
+KEY_PREFIX = 'metrics:'
+# The upper bounds, in milliseconds, of the buckets of histograms. Longer
+# durations are counted in the bucket 'inf'.
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+BUCKET_LABELS = [str(bound) for bound in BUCKETS] + ['inf']
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = [time.time()]
+
+
+def incr(name, delta=1):
+    """Adds delta to the named counter."""
+    with _lock:
+        _pending[name] = _pending.get(name, 0) + delta
+        if time.time() - _last_flush[0] < FLUSH_INTERVAL:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush[0] = time.time()
+    flush(pending)
+
+
+def timing(name, ms):
+    """Records a duration in milliseconds. The count and total are kept as
+    the counters name.count and name.total, so the average can be read from
+    the totals."""
+    incr(name + '.count')
+    incr(name + '.total', int(round(ms)))
+
+
+def histogram(name, ms):
+    """Records a duration in milliseconds in the named histogram. The count
+    and total are kept as with timing(), and each bucket as the counter
+    name.le_<bound>."""
+    label = 'inf'
+    for bound, bucket_label in zip(BUCKETS, BUCKET_LABELS):
+        if ms <= bound:
+            label = bucket_label
+            break
+    timing(name, ms)
+    incr('{}.le_{}'.format(name, label))
+
+
+def flush(pending=None):
+    """Adds counts which haven't been flushed yet to the totals in
+    memcache."""
+    if pending is None:
+        with _lock:
+            pending = dict(_pending)
+            _pending.clear()
+            _last_flush[0] = time.time()
+    if pending:
+        memcache.offset_multi(pending, key_prefix=KEY_PREFIX,
+                              initial_value=0)
+
+
+def totals(names):
+    """Returns a dict of the flushed totals of the named counters."""
+    counts = memcache.get_multi(names, key_prefix=KEY_PREFIX)
+    return dict((name, counts.get(name, 0)) for name in names)
+
+
+def histogram_totals(names):
+    """Returns a dict of the flushed totals of the named histograms. Each is
+    a dict of the count, the mean in milliseconds, and the number of
+    durations in each bucket by its upper bound. Histograms with nothing
+    recorded are left out."""
+    keys = []
+    for name in names:
+        keys += [name + '.count', name + '.total']
+        keys += ['{}.le_{}'.format(name, label) for label in BUCKET_LABELS]
+    counts = totals(keys)
+    results = {}
+    for name in names:
+        count = counts[name + '.count']
+        if not count:
+            continue
+        results[name] = {
+            'count': count,
+            'mean_ms': round(float(counts[name + '.total']) / count, 1),
+            'buckets': dict((label, counts['{}.le_{}'.format(name, label)])
+                            for label in BUCKET_LABELS),
+        }
+    return results
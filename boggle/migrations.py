@@ -0,0 +1,158 @@
+"""migrations.py - This file contains jobs which update existing entities
+when the way data is stored changes. Each job works through one page of
+entities per call, so that main.py can run it as a chain of tasks."""
+
+import datetime
+import logging
+
+from google.appengine.ext import ndb
+
+from models import (
+    User,
+    Game
+)
+
+
+PAGE_SIZE = 100
+# The properties copied when a user is re-keyed
+USER_FIELDS = ['name', 'email', 'wins', 'losses']
+
+
+def _legacy_games(old_key):
+    """Returns the games which refer to a user by their old key"""
+    keys = set()
+    for prop in (Game.user1, Game.user2, Game.winner):
+        keys.update(Game.query(prop == old_key).fetch(keys_only=True))
+    return list(keys)
+
+
+def _rekey_user(user):
+    """Moves a user with an id generated by the datastore to a key based on
+    their name, and points their games at the new key."""
+    new_key = User.key_for(user.name)
+
+    # Only the properties User declares are copied. Legacy users also have
+    # properties which have since been removed, such as the pickled games,
+    # and win_percentage is computed, so neither can be passed to the
+    # constructor.
+    values = user.to_dict(include=USER_FIELDS)
+
+    @ndb.transactional(xg=True)
+    def copy():
+        existing = new_key.get()
+        if existing is None:
+            User(key=new_key, **values).put()
+            return True
+        # A previous run may have copied the user before failing.
+        return existing.to_dict(include=USER_FIELDS) == values
+
+    if not copy():
+        logging.warning('Not migrating user %s: the name is taken by %s',
+                        user.key, new_key)
+        return False
+
+    @ndb.transactional
+    def update(game_key):
+        game = game_key.get()
+        for prop in ('user1', 'user2', 'winner'):
+            if getattr(game, prop) == user.key:
+                setattr(game, prop, new_key)
+        game.players = [new_key if key == user.key else key
+                        for key in game.players]
+        game.put()
+
+    for game_key in _legacy_games(user.key):
+        update(game_key)
+    user.key.delete()
+    return True
+
+
+def migrate_user_keys(cursor=None):
+    """Re-keys one page of users created before users were keyed by name.
+
+    Returns the cursor for the next page, or None when all users have been
+    processed.
+    """
+    users, next_cursor, more = User.query().fetch_page(
+        PAGE_SIZE, start_cursor=cursor)
+    migrated = 0
+    for user in users:
+        if user.key.id() != User.normalize(user.name):
+            migrated += _rekey_user(user)
+    logging.info('Migrated %d of %d users', migrated, len(users))
+    return next_cursor if more else None
+
+
+def backfill_game_players(cursor=None):
+    """Sets Game.players, and the players' names, on one page of games
+    created before they were added.
+
+    Returns the cursor for the next page, or None when all games have been
+    processed.
+    """
+    games, next_cursor, more = Game.query().fetch_page(
+        PAGE_SIZE, start_cursor=cursor)
+    updated = [game for game in games
+               if not game.players or game.user1_name is None
+               or game.user2_name is None]
+    keys = set()
+    for game in updated:
+        keys.update([game.user1, game.user2])
+    users = dict((u.key, u) for u in ndb.get_multi(list(keys)) if u)
+    for game in updated:
+        game.players = [game.user1, game.user2]
+        game.user1_name = users[game.user1].name
+        game.user2_name = users[game.user2].name
+    ndb.put_multi(updated)
+    logging.info('Set players on %d of %d games', len(updated), len(games))
+    return next_cursor if more else None
+
+
+def backfill_win_percentage(cursor=None):
+    """Re-puts one page of users, so that their win_percentage is stored
+    and indexed.
+
+    Returns the cursor for the next page, or None when all users have been
+    processed.
+    """
+    users, next_cursor, more = User.query().fetch_page(
+        PAGE_SIZE, start_cursor=cursor)
+    ndb.put_multi(users)
+    logging.info('Stored win_percentage on %d users', len(users))
+    return next_cursor if more else None
+
+
+def backfill_game_updated(cursor=None):
+    """Sets Game.updated to now on one page of games which were last put
+    before it was added, or re-put by a migration since. Their real last
+    move isn't known, so they are only expired or archived once IDLE_TTL or
+    ARCHIVE_AFTER has passed from now, see archive.py.
+
+    Returns the cursor for the next page, or None when all games have been
+    processed.
+    """
+    games, next_cursor, more = Game.query().fetch_page(
+        PAGE_SIZE, start_cursor=cursor)
+    now = datetime.datetime.utcnow()
+    updated = [game for game in games if game.updated is None]
+    for game in updated:
+        game.updated = now
+    ndb.put_multi(updated)
+    logging.info('Set updated on %d of %d games', len(updated), len(games))
+    return next_cursor if more else None
+
+
+def migrate_game_encoding(cursor=None):
+    """Re-puts one page of games, so that games whose board and words found
+    are pickled are stored with the current encoding instead, see
+    Game.upgrade_encoding().
+
+    Returns the cursor for the next page, or None when all games have been
+    processed.
+    """
+    games, next_cursor, more = Game.query().fetch_page(
+        PAGE_SIZE, start_cursor=cursor)
+    updated = [game for game in games if game.encoding is None]
+    ndb.put_multi(updated)
+    logging.info('Encoded %d of %d games', len(updated), len(games))
+    return next_cursor if more else None
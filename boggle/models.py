@@ -2,22 +2,75 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
+import datetime
 from decimal import Decimal
 import json
 
+from google.appengine.datastore import entity_pb
 from google.appengine.ext import ndb
 from protorpc import messages
 
 import boggle
+from cache import LRUCache
+import counters
+from dictionary import get_dictionary
+import instrument
+import pool
+import solver
+
+
+# The current encoding of Game.letters and Game.found
+ENCODING_VERSION = 1
+
+# Maps normalized names to the keys of users created before users were keyed
+# by name, see User.get_by_name_async()
+_legacy_user_keys = LRUCache(1000)
 
 
 class User(ndb.Model):
-    """User profile"""
+    """User profile. New users are keyed by their normalized name, see
+    User.key_for()"""
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
-    games = ndb.PickleProperty(required=True, default=[""])
     wins = ndb.IntegerProperty(required=True, default=0)
     losses = ndb.IntegerProperty(required=True, default=0)
+    # Stored and indexed so that the rankings can be read with one query
+    win_percentage = ndb.ComputedProperty(lambda self: self._win_percentage())
+
+    @staticmethod
+    def normalize(name):
+        """Returns the form of a name used in user keys. Names which only
+        differ in case or surrounding spaces belong to the same user."""
+        return name.strip().lower()
+
+    @classmethod
+    def key_for(cls, name):
+        """Returns the key of the user with the given name"""
+        return ndb.Key(cls, cls.normalize(name))
+
+    @classmethod
+    @ndb.tasklet
+    def get_by_name_async(cls, name):
+        """Returns the user with the given name, or None.
+
+        Users are looked up by key. Users created before users were keyed by
+        name are found with a query on their name instead, and their keys
+        are cached so the query only runs once per instance.
+        """
+        normalized = cls.normalize(name)
+        legacy_key = _legacy_user_keys.get(normalized)
+        if legacy_key is not None:
+            user = yield legacy_key.get_async()
+            if user is not None:
+                raise ndb.Return(user)
+            # The user has been migrated since the key was cached.
+            _legacy_user_keys.set(normalized, None)
+        user = yield cls.key_for(name).get_async()
+        if user is None:
+            user = yield cls.query(cls.name == name).get_async()
+            if user is not None:
+                _legacy_user_keys.set(normalized, user.key)
+        raise ndb.Return(user)
 
     def to_form(self):
         """Returns a GameForm representation of the Game"""
@@ -26,7 +79,7 @@ class User(ndb.Model):
         form.name = self.name
         return form
 
-    def win_percentage(self):
+    def _win_percentage(self):
         """Calculates the percentage of games won out of games played"""
         if self.wins + self.losses < 1:
             return float(0)
@@ -38,7 +91,7 @@ class User(ndb.Model):
     def to_performance_form(self):
         form = UserPerformanceForm()
         form.name = self.name
-        form.win_percentage = self.win_percentage()
+        form.win_percentage = self.win_percentage
         form.wins = self.wins
         form.losses = self.losses
         form.urlsafe_key = self.key.urlsafe()
@@ -49,80 +102,264 @@ class Game(ndb.Model):
     """Game object"""
     user1 = ndb.KeyProperty(required=True, kind='User')
     user2 = ndb.KeyProperty(required=True, kind='User')
-    board = ndb.PickleProperty(required=True)  # NxN list of letters
+    # Both users, so that a user's games can be found with one query
+    players = ndb.KeyProperty(kind='User', repeated=True)
+    # Stored so that the game can be rendered without fetching its users
+    user1_name = ndb.StringProperty(indexed=False)
+    user2_name = ndb.StringProperty(indexed=False)
+    # The version of the encoding used for the board and words found. None
+    # for games which stored them as pickled lists, see upgrade_encoding()
+    encoding = ndb.IntegerProperty()
+    # The board's letters row by row, see boggle.encode_board()
+    letters = ndb.StringProperty(indexed=False)
+    board_size = ndb.IntegerProperty(indexed=False)
+    # The board's id in hex, see boggle.roll(). Together with board_size it
+    # identifies the board. Ids need more than 64 bits, so they are stored as
+    # strings.
+    board_id = ndb.StringProperty(indexed=False)
+    # The words found so far, sorted and space separated
+    found = ndb.TextProperty(default='')
     user1_points = ndb.IntegerProperty(required=True, default=0)
     user2_points = ndb.IntegerProperty(required=True, default=0)
-    words_found = ndb.PickleProperty(required=True, default=[])
     turns_allowed = ndb.IntegerProperty(required=True)
     turns_remaining = ndb.IntegerProperty(required=True)
     user1_is_next = ndb.BooleanProperty(required=True, default=True)
     game_over = ndb.BooleanProperty(required=True, default=False)
     game_cancelled = ndb.BooleanProperty(required=True, default=False)
     winner = ndb.KeyProperty(kind='User')
-    history = ndb.PickleProperty(required=True, default=[])
+    # Only set on games played before moves were stored as Move entities
+    history = ndb.PickleProperty()
+    # The number of Move entities recorded for the game
+    moves_recorded = ndb.IntegerProperty(required=True, default=0)
+    # When the game was last played, or ended, used to only remind players
+    # of games which have been played since their last reminder, and to
+    # expire and archive games. It is set by the changes players make, not
+    # on every put, so that migrations which re-put games leave it alone.
+    # None for games which haven't been played since this was added, until
+    # migrations.backfill_game_updated sets it.
+    updated = ndb.DateTimeProperty()
+    # Every dictionary word on the board, sorted and space separated.
+    # None if there was no dictionary to solve the board with.
+    solution = ndb.TextProperty(compressed=True)
+    # Only set on games created before the board and words found were
+    # encoded as strings
+    board = ndb.PickleProperty()  # NxN list of letters
+    words_found = ndb.PickleProperty()
+
+    def _pre_put_hook(self):
+        self.upgrade_encoding()
+
+    def upgrade_encoding(self):
+        """Moves the board and words found of an older game out of its
+        pickled properties and into the encoded ones. Games are upgraded
+        whenever they are put."""
+        if self.encoding is None:
+            self.letters = boggle.encode_board(self.board)
+            self.board_size = len(self.board)
+            self.found = ' '.join(sorted(self.words_found or []))
+            self.board = None
+            self.words_found = None
+            self.encoding = ENCODING_VERSION
 
     @classmethod
-    def new_game(cls, user1, user2, turns):
-        """Creates and returns a new game"""
-        board = boggle.board()
-        game = Game(board=board,
-                    user1=user1,
-                    user2=user2,
-                    words_found=[],
+    @ndb.tasklet
+    def new_game_async(cls, user1, user2, turns, size=4, pool_key=None):
+        """Creates and returns a new game. Call this inside a transaction,
+        since it updates the open game counters.
+        Args:
+            user1, user2: the User entities playing the game
+            turns: the number of turns allowed
+            size: the width of the board, one of boggle.BOARD_SIZES
+            pool_key: the key of a pooled board to use, see pool.py. A new
+                board is rolled if it is None or the board is already taken.
+        """
+        entry = None
+        if pool_key is not None:
+            entry = yield pool.claim_async(pool_key)
+        if entry is not None:
+            letters = entry.letters
+            board_id = entry.board_id
+            solution = entry.solution
+        else:
+            rolled = boggle.roll(size)
+            board = boggle.board_from_id(rolled, size)
+            letters = boggle.encode_board(board)
+            board_id = format(rolled, 'x')
+            dictionary = get_dictionary()
+            solution = None
+            if dictionary is not None:
+                solution = ' '.join(sorted(solver.solve(board, dictionary)))
+        game = Game(encoding=ENCODING_VERSION,
+                    letters=letters,
+                    board_size=size,
+                    board_id=board_id,
+                    solution=solution,
+                    user1=user1.key,
+                    user2=user2.key,
+                    players=[user1.key, user2.key],
+                    user1_name=user1.name,
+                    user2_name=user2.name,
                     user1_is_next=True,
                     turns_allowed=turns,
                     turns_remaining=turns,
-                    game_over=False)
-        game.put()
-        return game
+                    game_over=False,
+                    updated=datetime.datetime.utcnow())
+        yield (game.put_async(),
+               counters.increment_async(counters.OPEN_GAMES, 1),
+               counters.increment_async(counters.TURNS_REMAINING, turns))
+        raise ndb.Return(game)
+
+    def grid(self):
+        """Returns the board as an NxN list of single character strings"""
+        if self.encoding is None:
+            return self.board
+        return boggle.decode_board(self.letters, self.board_size)
+
+    def found_words(self):
+        """Returns the set of words found so far"""
+        if self.encoding is None:
+            return set(self.words_found or [])
+        if getattr(self, '_found_set', None) is None:
+            self._found_set = set(self.found.split())
+        return self._found_set
+
+    def add_found_word(self, word):
+        """Adds a word to the words found so far"""
+        self.upgrade_encoding()
+        words = self.found_words() | set([word])
+        self.found = ' '.join(sorted(words))
+        self._found_set = words
 
     def pretty_board(self):
         """returns a more readable board"""
         output = ""
-        for row in self.board:
+        for row in self.grid():
             for char in row:
                 output += char + " "
             output += " | "
         return output
 
+    def solution_set(self):
+        """Returns the set of dictionary words on the board, or None if the
+        board wasn't solved when the game was created."""
+        if self.solution is None:
+            return None
+        if getattr(self, '_solution_set', None) is None:
+            self._solution_set = set(self.solution.split())
+        return self._solution_set
+
     def check_word(self, word):
         """Returns a boolean value indicating whether the word
         can actually be constructed from the board.
         """
-        # use the boggle.find_letters() function to get a list of the coords
-        # of the words
-        word_coords = boggle.find_letters(word, self.board)
-        # check for a continuous path among thos coordinates
-        return boggle.all_paths(word, word_coords)
-
-    def to_form(self, message):
-        """Returns a GameForm representation of the Game"""
+        return word in self.check_words([word])
+
+    def check_words(self, words):
+        """Returns the set of the upper case words which can be constructed
+        from the board, checking them all in one pass."""
+        with instrument.phase('board_check'):
+            words = set(words)
+            found = set()
+            solution = self.solution_set()
+            if solution is not None:
+                found = words & solution
+                words -= found
+                # The solver would have found any dictionary word on the
+                # board.
+                dictionary = get_dictionary()
+                if dictionary is not None:
+                    words = set(word for word in words
+                                if not dictionary.is_word(word))
+            if not words:
+                return found
+            # search the board for a continuous path spelling each word
+            board = self.grid()
+            found.update(word for word in words
+                         if boggle.find_path(word, board) is not None)
+            return found
+
+    def _names(self):
+        """Returns a dict of the names stored on the game, by user key"""
+        names = {}
+        if self.user1_name is not None:
+            names[self.user1] = self.user1_name
+        if self.user2_name is not None:
+            names[self.user2] = self.user2_name
+        return names
+
+    def _unnamed_user_keys(self):
+        """Returns the keys of the game's users whose names aren't stored on
+        the game, and need to be fetched to render it."""
+        keys = [self.user1, self.user2]
+        if self.winner is not None:
+            keys.append(self.winner)
+        names = self._names()
+        return [key for key in keys if key not in names]
+
+    def to_form(self, message, users=None):
+        """Returns a GameForm representation of the Game
+        Args:
+            message: the message to include in the form
+            users: an optional dict of already loaded User entities, by key.
+                Users whose names aren't stored on the game, and aren't in
+                the dict, are fetched together in one batch.
+        """
+        users = dict(users or {})
+        names = self._names()
+        missing = [key for key in self._unnamed_user_keys()
+                   if key not in users]
+        users.update((u.key, u) for u in ndb.get_multi(missing) if u)
+        for key, user in users.items():
+            names.setdefault(key, user.name)
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user1_name = self.user1.get().name
-        form.user2_name = self.user2.get().name
+        form.user1_name = names[self.user1]
+        form.user2_name = names[self.user2]
         form.user1_points = self.user1_points
         form.user2_points = self.user2_points
         form.user1_is_next = self.user1_is_next
         form.turns_remaining = self.turns_remaining
         form.board = self.pretty_board()
-        form.words_found = json.dumps(self.words_found)
+        form.words_found = json.dumps(sorted(self.found_words()))
         form.game_over = self.game_over
         form.message = message
         if self.winner is not None:
-            form.winner = self.winner.get().name
+            form.winner = names[self.winner]
         return form
 
-    def enter_history(self, user, message):
-        self.history.append({
-            'user': user.name,
-            'message': message
-            })
-        self.put()
-
-    def end_game(self, cancelled_by=None):
-        """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
+    @classmethod
+    def to_forms(cls, games, message):
+        """Returns a list of GameForms for a list of games, fetching every
+        user needed to render them in one batch."""
+        keys = set()
+        for game in games:
+            keys.update(game._unnamed_user_keys())
+        users = dict((u.key, u) for u in ndb.get_multi(list(keys)) if u)
+        return [game.to_form(message, users) for game in games]
+
+    def record_move(self, user, guess, points, message):
+        """Returns a Move entity recording a turn in the game. The move and
+        the game both still need to be put."""
+        self.moves_recorded += 1
+        self.updated = datetime.datetime.utcnow()
+        return Move(parent=self.key,
+                    id=self.moves_recorded,
+                    user=user.name,
+                    guess=guess,
+                    points=points,
+                    message=message)
+
+    @ndb.tasklet
+    def end_game_async(self, cancelled_by=None):
+        """Ends the game, and updates the wins and losses of its users.
+        Nothing is put, so that the caller can write the game and users
+        together with its other changes. The open game counters are updated,
+        so call this inside the caller's transaction.
+
+        Returns a tuple of the winning and losing User entities, which are
+        both None if the game was tied.
+        """
+        self.updated = datetime.datetime.utcnow()
         if cancelled_by is not None:
             #  make the non-cancelling user the winner
             if (cancelled_by == self.user2):
@@ -133,21 +370,74 @@ class Game(ndb.Model):
         elif self.user1_points > self.user2_points:
             w, l = self.user1, self.user2
         elif self.user2_points > self.user1_points:
-            w, l = self.user1, self.user2
+            w, l = self.user2, self.user1
         else:
             # players are tied
             w, l = None, None
-        # update user entities and the game entity accordingly
-        winning_user = w.get()
-        winning_user.wins += 1
-        winning_user.put()
-        losing_user = l.get()
-        losing_user.losses += 1
-        losing_user.put()
         self.winner = w
         self.game_over = True
-        self.put()
-        return w, l
+        yield (counters.increment_async(counters.OPEN_GAMES, -1),
+               counters.increment_async(counters.TURNS_REMAINING,
+                                        -self.turns_remaining))
+        if w is None:
+            raise ndb.Return(None, None)
+        # update user entities accordingly
+        winning_user, losing_user = yield ndb.get_multi_async([w, l])
+        winning_user.wins += 1
+        losing_user.losses += 1
+        raise ndb.Return(winning_user, losing_user)
+
+
+class Move(ndb.Model):
+    """A single turn in a game. Moves are children of their Game entity,
+    numbered from 1 in the order they were made."""
+    user = ndb.StringProperty(required=True, indexed=False)
+    guess = ndb.StringProperty(indexed=False)
+    points = ndb.IntegerProperty(required=True, default=0, indexed=False)
+    message = ndb.StringProperty(required=True, indexed=False)
+    timestamp = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+    def to_turn(self):
+        """Returns the move as a dict which can be serialized to JSON"""
+        return {
+            'user': self.user,
+            'guess': self.guess,
+            'points': self.points,
+            'message': self.message,
+            'timestamp': self.timestamp.isoformat()
+        }
+
+
+class ArchivedGame(ndb.Model):
+    """A finished game and its moves, moved out of the Game kind once the
+    game is old enough, see archive.py. It has the same id as the game."""
+    players = ndb.KeyProperty(kind='User', repeated=True)
+    finished = ndb.DateTimeProperty()
+    # The encoded Game entity
+    game = ndb.BlobProperty(required=True, compressed=True)
+    # A JSON list of the game's moves, see Move.to_turn()
+    turns = ndb.TextProperty(compressed=True)
+
+    @classmethod
+    def from_game(cls, game, moves):
+        """Returns an ArchivedGame holding a game and its Move entities,
+        which still needs to be put."""
+        # Moves made before moves were stored as entities come first
+        turns = (game.history or []) + [move.to_turn() for move in moves]
+        return cls(id=game.key.id(),
+                   players=game.players,
+                   finished=game.updated,
+                   game=ndb.ModelAdapter().entity_to_pb(game).Encode(),
+                   turns=json.dumps(turns))
+
+    def restore(self):
+        """Returns the archived Game entity. It isn't put back."""
+        return ndb.ModelAdapter().pb_to_entity(
+            entity_pb.EntityProto(self.game))
+
+    def turn_list(self):
+        """Returns the game's moves as a list of dicts"""
+        return json.loads(self.turns or '[]')
 
 
 class UserForm(messages.Message):
@@ -167,6 +457,7 @@ class UserPerformanceForm(messages.Message):
 
 class UserPerformanceForms(messages.Message):
     users = messages.MessageField(UserPerformanceForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class GameForm(messages.Message):
@@ -189,6 +480,7 @@ class UserGameForms(messages.Message):
     """Multiple GameForms for a User"""
     user = messages.MessageField(UserForm, 1)
     games = messages.MessageField(GameForm, 2, repeated=True)
+    next_cursor = messages.StringField(3)
 
 
 class NewGameForm(messages.Message):
@@ -196,6 +488,8 @@ class NewGameForm(messages.Message):
     user1_name = messages.StringField(1, required=True)
     user2_name = messages.StringField(2, required=True)
     turns = messages.IntegerField(3, default=20)
+    board_size = messages.IntegerField(4, default=4)
+    difficulty = messages.StringField(5)
 
 
 class MakeMoveForm(messages.Message):
@@ -204,12 +498,19 @@ class MakeMoveForm(messages.Message):
     guess = messages.StringField(2, required=True)
 
 
+class MakeMovesForm(messages.Message):
+    """Used to submit several guesses as one move in an existing game"""
+    user_name = messages.StringField(1, required=True)
+    guesses = messages.StringField(2, repeated=True)
+
+
 class GameHistoryForm(messages.Message):
     """Contains a GameForm, and the game's history in the form of informative
     messages for each turn.
     """
     game = messages.MessageField(GameForm, 1, required=True)
     turns = messages.StringField(2, repeated=True)
+    next_cursor = messages.StringField(3)
 
 
 class StringMessage(messages.Message):
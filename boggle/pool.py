@@ -0,0 +1,157 @@
+"""pool.py - This file contains the pool of pre-generated boards, which new
+games take their boards from.
+
+Boards are generated, solved and graded in batches by a task (see
+RefillBoardPool in main.py), so creating a game doesn't have to solve its
+board, and boards with too few words never reach a game. Each board is
+graded into a difficulty band by the number of scoring words on it.
+
+The number of boards in the pool of each size is kept by a sharded counter.
+When a claim leaves it below LOW_WATER_MARK a refill task is queued, which
+keeps adding batches until the pool reaches HIGH_WATER_MARK.
+"""
+
+import random
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import boggle
+import counters
+from dictionary import get_dictionary
+import solver
+
+
+BATCH_SIZE = 50
+LOW_WATER_MARK = 200
+HIGH_WATER_MARK = 1000
+# The number of pooled boards a claim chooses between at random, so that
+# games created at the same time rarely try to claim the same board.
+CLAIM_CHOICES = 20
+
+DIFFICULTIES = ['easy', 'medium', 'hard']
+# The fewest scoring words a pooled board may have, by board size
+MIN_WORDS = {4: 30, 5: 80, 6: 150}
+# Boards with fewer scoring words than the first number are hard, and boards
+# with at least the second are easy, by board size.
+BANDS = {4: (80, 160), 5: (200, 400), 6: (400, 800)}
+
+
+class BoardPool(ndb.Model):
+    """A solved board waiting to be used by a game"""
+    letters = ndb.StringProperty(required=True, indexed=False)
+    board_size = ndb.IntegerProperty(required=True)
+    board_id = ndb.StringProperty(required=True, indexed=False)
+    solution = ndb.TextProperty(compressed=True)
+    word_count = ndb.IntegerProperty(required=True, indexed=False)
+    max_score = ndb.IntegerProperty(required=True, indexed=False)
+    difficulty = ndb.StringProperty(required=True, choices=DIFFICULTIES)
+
+
+def difficulty(word_count, size):
+    """Returns the difficulty band of a board with the given number of
+    scoring words, or None if it has too few words to be used."""
+    if word_count < MIN_WORDS[size]:
+        return None
+    hard, easy = BANDS[size]
+    if word_count < hard:
+        return 'hard'
+    if word_count < easy:
+        return 'medium'
+    return 'easy'
+
+
+def generate(count, size):
+    """Generates and grades boards, returning the unput BoardPool entities of
+    those good enough to keep. Returns an empty list if there is no
+    dictionary to solve them with."""
+    dictionary = get_dictionary()
+    if dictionary is None:
+        return []
+    entries = []
+    for board_id, board in boggle.boards(count, size):
+        solution = solver.solve(board, dictionary)
+        # The board is graded by the words which score, but the game needs
+        # every word on it, see Game.check_words
+        words = [word for word in solution if boggle.word_points(word)]
+        band = difficulty(len(words), size)
+        if band is None:
+            continue
+        entries.append(BoardPool(letters=boggle.encode_board(board),
+                                 board_size=size,
+                                 board_id=format(board_id, 'x'),
+                                 solution=' '.join(sorted(solution)),
+                                 word_count=len(words),
+                                 max_score=sum(boggle.word_points(word)
+                                               for word in words),
+                                 difficulty=band))
+    return entries
+
+
+@ndb.tasklet
+def candidate_async(size, band=None):
+    """Returns the key of a pooled board of the given size, and difficulty
+    band if one is given, or None if there are none. Call this outside of a
+    transaction, then claim the board inside it with claim_async."""
+    query = BoardPool.query(BoardPool.board_size == size)
+    if band is not None:
+        query = query.filter(BoardPool.difficulty == band)
+    keys = yield query.fetch_async(CLAIM_CHOICES, keys_only=True)
+    raise ndb.Return(random.choice(keys) if keys else None)
+
+
+@ndb.tasklet
+def claim_async(key):
+    """Removes a pooled board from the pool and returns it, or returns None
+    if another game claimed it first. Call this inside the transaction which
+    creates the game, so that the board is only used once."""
+    entry = yield key.get_async()
+    if entry is None:
+        raise ndb.Return(None)
+    yield (key.delete_async(),
+           counters.increment_async(counters.board_pool(entry.board_size),
+                                    -1))
+    raise ndb.Return(entry)
+
+
+def queue_refill(size):
+    """Queues a refill of the pool of boards of the given size. Refills
+    queued within the same minute are merged into one."""
+    try:
+        taskqueue.add(url='/tasks/refill_board_pool',
+                      params={'size': size},
+                      name='refill-board-pool-{}-{}'.format(
+                          size, int(time.time() // 60)))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.tasklet
+def check_low_water_async(size):
+    """Queues a refill if the pool of boards of the given size is below its
+    low-water mark."""
+    name = counters.board_pool(size)
+    totals = yield counters.get_totals_async([name])
+    if totals[name] < LOW_WATER_MARK:
+        queue_refill(size)
+
+
+def refill(size):
+    """Adds one batch of boards to the pool. Returns the number of boards
+    added, and the number of boards in the pool afterwards."""
+    entries = generate(BATCH_SIZE, size)
+    name = counters.board_pool(size)
+    ndb.put_multi(entries)
+    # Any drift from a failure between the put and the increment is
+    # corrected by the ReconcileCounters cron job.
+    ndb.transaction(lambda: counters.increment_async(name, len(entries))
+                    .get_result())
+    total = counters.get_totals_async([name]).get_result()[name]
+    return len(entries), total
+
+
+def count(size):
+    """Counts the boards of the given size in the pool, for reconciling its
+    counter"""
+    return BoardPool.query(BoardPool.board_size == size).count()
@@ -0,0 +1,186 @@
+"""reminders.py - This file contains the reminder digests emailed to players
+of unfinished games, and the tasks which send them.
+
+Each player with an email address gets at most one message per run, listing
+every unfinished game that has changed since they were last reminded: the
+games where it is their turn, and the games where they are waiting for
+their opponent. A ReminderMarker per player records when they were last
+reminded, so a game nobody has played since isn't reported again.
+
+A run is started by a cron job. The players with an email address are split
+into shards of PAGE_SIZE players, marked by a start and an end query
+cursor, and each shard is queued as its own task. Finding the shard
+boundaries only reads keys, and is itself continued in a chain of tasks
+when there are many players.
+
+A shard sends its digests in batches of MAIL_BATCH_SIZE, and puts the
+markers of the players in a batch once it is sent. If the task fails and
+is retried, the players already reminded in this run have nothing new to
+report, so they aren't emailed again.
+"""
+
+import datetime
+import logging
+import time
+
+from google.appengine.api import app_identity, mail, taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import User, Game
+from utils import games_and_users
+
+
+PAGE_SIZE = 100
+MAIL_BATCH_SIZE = 20
+# The number of shards queued by each task which finds shard boundaries.
+SHARDS_PER_TASK = 50
+
+
+class ReminderMarker(ndb.Model):
+    """When a player was last reminded of their games. The id is the
+    player's key id."""
+    last_notified = ndb.DateTimeProperty(required=True, indexed=False)
+
+
+def _recipients():
+    """Returns the query for players who can be emailed"""
+    return User.query(User.email > '')
+
+
+def _marker_key(user_key):
+    return ndb.Key(ReminderMarker, user_key.id())
+
+
+def _digest(user, games):
+    """Returns the email reminding a user of their games, as a tuple of
+    (to, subject, body).
+    Args:
+        games: a list of (urlsafe game key, opponent, is user's turn)
+    """
+    your_turn = [game for game in games if game[2]]
+    waiting = [game for game in games if not game[2]]
+    if your_turn:
+        subject = 'It\'s your turn in {} game{}!'.format(
+            len(your_turn), '' if len(your_turn) == 1 else 's')
+    else:
+        subject = 'Your games aren\'t over yet!'
+    lines = ['Hello {}, here are your unfinished games:'.format(user.name),
+             '']
+    for urlsafe_game_key, opponent, _ in your_turn:
+        lines.append('It\'s your turn to find a word in the game: {}! {} is '
+                     'waiting for you!'.format(urlsafe_game_key,
+                                               opponent.name))
+    for urlsafe_game_key, opponent, _ in waiting:
+        lines.append('It\'s {}\'s turn to find a word in the game: {}. Your '
+                     'turn will be next!'.format(opponent.name,
+                                                 urlsafe_game_key))
+    return user.email, subject, '\n'.join(lines)
+
+
+def start():
+    """Starts a reminder run"""
+    taskqueue.add(url='/tasks/queue_reminders',
+                  params={'run': repr(time.time())})
+
+
+def queue_shards(run, cursor=None, shard=0):
+    """Queues a task for each of the next SHARDS_PER_TASK shards of
+    players, starting at cursor.
+
+    Returns the cursor and number of the next shard to queue, or None and
+    the number of shards queued in total once every player is covered.
+    """
+    query = _recipients()
+    tasks = []
+    next_cursor = None
+    for i in range(SHARDS_PER_TASK):
+        keys, end, more = query.fetch_page(PAGE_SIZE, start_cursor=cursor,
+                                           keys_only=True)
+        if not keys:
+            break
+        tasks.append(taskqueue.Task(
+            url='/tasks/send_reminders',
+            params={'run': run,
+                    'shard': shard,
+                    'start': cursor.urlsafe() if cursor else '',
+                    'end': end.urlsafe()}))
+        shard += 1
+        cursor = end
+        if not more:
+            break
+    else:
+        next_cursor = cursor
+    if tasks:
+        taskqueue.Queue().add(tasks)
+    return next_cursor, shard
+
+
+@ndb.tasklet
+def _open_games_async(user_key):
+    games = yield Game.query(Game.players == user_key,
+                             Game.game_over == False).fetch_async()
+    raise ndb.Return(games)
+
+
+def send_shard(run, start, end):
+    """Sends a digest to each player between the start and end cursors who
+    has games that changed since they were last reminded. Returns the number
+    of digests sent."""
+    started = datetime.datetime.utcfromtimestamp(float(run))
+    users = _recipients().fetch(start_cursor=start, end_cursor=end)
+    recipients = dict((user.key, user) for user in users)
+    markers = dict(zip(recipients, ndb.get_multi(
+        [_marker_key(key) for key in recipients])))
+
+    # The open games of every player in the shard, read at once. A game
+    # between two players in the shard is read twice, so keep one copy.
+    games = {}
+    futures = [_open_games_async(key) for key in recipients]
+    for future in futures:
+        for game in future.get_result():
+            games[game.key] = game
+
+    def changed(game, user_key):
+        marker = markers[user_key]
+        if marker is None:
+            return True
+        if marker.last_notified >= started:
+            # Already reminded in this run, before a retry
+            return False
+        return (game.updated is not None and
+                game.updated > marker.last_notified)
+
+    # Group the games by recipient in one pass. Each game is reported to
+    # whichever of its players are in the shard.
+    grouped = {}
+    for urlsafe_game_key, next_user, waiting_user in games_and_users(
+            games.values()):
+        game = games[ndb.Key(urlsafe=urlsafe_game_key)]
+        for user, opponent, is_next in ((next_user, waiting_user, True),
+                                        (waiting_user, next_user, False)):
+            if user.key in recipients and changed(game, user.key):
+                grouped.setdefault(user.key, []).append(
+                    (urlsafe_game_key, opponent, is_next))
+    digests = [(user_key, _digest(recipients[user_key], user_games))
+               for user_key, user_games in grouped.items()]
+
+    sender = 'noreply@{}.appspotmail.com'.format(
+        app_identity.get_application_id())
+    for i in range(0, len(digests), MAIL_BATCH_SIZE):
+        batch = digests[i:i + MAIL_BATCH_SIZE]
+        for user_key, (to, subject, body) in batch:
+            # This will send test emails, the arguments to send_mail are:
+            # from, to, subject, body
+            mail.send_mail(sender, to, subject, body)
+        ndb.put_multi([ReminderMarker(key=_marker_key(user_key),
+                                      last_notified=started)
+                       for user_key, email in batch])
+    logging.info('Sent %d reminder digests for %d open games',
+                 len(digests), len(games))
+    return len(digests)
+
+
+def parse_cursor(urlsafe):
+    """Returns the Cursor for a urlsafe string, or None if it is empty"""
+    return Cursor(urlsafe=urlsafe) if urlsafe else None
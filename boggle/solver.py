@@ -0,0 +1,39 @@
+"""solver.py - This file contains the board solver, which finds every
+dictionary word that can be spelled on a boggle board."""
+
+from boggle import NEIGHBOURS
+
+
+def solve(board, dictionary):
+    """Returns the set of all words in the dictionary which can be found on
+    the board.
+
+    The search starts from every cell, and narrows the range of dictionary
+    words sharing the letters so far as it moves to adjacent unused cells,
+    so a branch ends as soon as the letters aren't the start of any word.
+
+    Args:
+        board: an NxN list of single character strings.
+        dictionary: a dictionary.Dictionary
+    """
+    cells = [letter for row in board for letter in row]
+    table = NEIGHBOURS[len(board)]
+    found = set()
+
+    def search(index, lo, hi, prefix, visited):
+        # The shortest word in the range comes first.
+        if dictionary.letter(lo, len(prefix)) == '':
+            found.add(prefix)
+        for n in table[index]:
+            if not visited & (1 << n):
+                sub_lo, sub_hi = dictionary.narrow(lo, hi, len(prefix),
+                                                   cells[n])
+                if sub_lo < sub_hi:
+                    search(n, sub_lo, sub_hi, prefix + cells[n],
+                           visited | (1 << n))
+
+    for start, letter in enumerate(cells):
+        lo, hi = dictionary.prefix_range(letter)
+        if lo < hi:
+            search(start, lo, hi, letter, 1 << start)
+    return found
@@ -1,41 +1,152 @@
 """utils.py - File for collecting general utility functions."""
 
+import time
+
 import endpoints
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
 
+from dictionary import get_dictionary
+import instrument
+import lookup
+import metrics
 from models import (
     User,
     Game
 )
 
 
-def games_and_users():
-    """A helper function (used in main.py) to identify unfinished games,
-    and their users.
+# How many times a transaction is retried when it collides with another
+# request writing the same entities.
+TRANSACTION_RETRIES = 5
+TRANSACTIONS = ['new_game', 'move', 'cancel']
+TRANSACTION_COUNTERS = [
+    '{}.{}'.format(name, counter) for name in TRANSACTIONS
+    for counter in ('commits', 'retries', 'failed', 'commit_ms.count',
+                    'commit_ms.total')]
+
+
+@ndb.tasklet
+def transaction_async(name, callback):
+    """Runs callback in a cross-group transaction, retrying it if the
+    transaction collides with another, and counts the retries and time taken
+    under the given name.
+
+    Raises a ConflictException if the transaction still fails after
+    TRANSACTION_RETRIES retries.
+    """
+    attempts = [0]
+
+    def attempt():
+        attempts[0] += 1
+        return callback()
 
+    start = time.time()
+    try:
+        with instrument.phase('transaction'):
+            result = yield ndb.transaction_async(attempt, xg=True,
+                                                 retries=TRANSACTION_RETRIES)
+    except datastore_errors.TransactionFailedError:
+        metrics.incr(name + '.failed')
+        raise endpoints.ConflictException(
+            'The game is busy, please try again.')
+    finally:
+        metrics.incr(name + '.retries', attempts[0] - 1)
+        metrics.timing(name + '.commit_ms', (time.time() - start) * 1000)
+    metrics.incr(name + '.commits')
+    raise ndb.Return(result)
+
+
+def games_and_users(games=None):
+    """A helper function (used in reminders.py) to identify unfinished
+    games, and their users. The users of every game are read with one
+    get_multi.
+
+    Args:
+        games: the games to look at. Defaults to every unfinished game.
     Returns:
-        a 3-tuple of:
-            - the game,
+        a list of 3-tuples of:
+            - the urlsafe key of the game,
             - the user who has the next turn,
             - the waiting user
+        Games whose users no longer exist are left out.
     """
-    open_games = Game.query(Game.game_over == False).fetch()
+    if games is None:
+        games = Game.query(Game.game_over == False).fetch()
+    keys = set()
+    for game in games:
+        keys.update([game.user1, game.user2])
+    keys = list(keys)
+    users = dict(zip(keys, ndb.get_multi(keys)))
     games_list = []
-    for game in open_games:
+    for game in games:
+        user1, user2 = users[game.user1], users[game.user2]
+        if user1 is None or user2 is None:
+            continue
         if game.user1_is_next:
             # create a tuple for storing the next user and url safe game key
-            games_list.append((game.key.urlsafe(),
-                              game.user1.get(),
-                              game.user2.get())
-                              )
+            games_list.append((game.key.urlsafe(), user1, user2))
         else:
-            games_list.append((game.key.urlsafe(),
-                              game.user2.get(),
-                              game.user1.get())
-                              )
+            games_list.append((game.key.urlsafe(), user2, user1))
     return games_list
 
 
+@ndb.tasklet
+def is_english_word_async(word):
+    """Returns True if the upper case word is in the english dictionary.
+
+    The local dictionary is used if one has been deployed with the app.
+    Otherwise the word is looked up with the cached Merriam-Webster API, see
+    lookup.py.
+    """
+    with instrument.phase('dictionary'):
+        dictionary = get_dictionary()
+        if dictionary is not None:
+            raise ndb.Return(dictionary.is_word(word))
+        valid = yield lookup.is_word_async(word)
+    raise ndb.Return(valid)
+
+
+@ndb.tasklet
+def english_words_async(words):
+    """Returns the set of the upper case words which are in the english
+    dictionary. Words missing from the local dictionary's cache are looked up
+    at the same time."""
+    with instrument.phase('dictionary'):
+        dictionary = get_dictionary()
+        if dictionary is not None:
+            raise ndb.Return(set(word for word in words
+                                 if dictionary.is_word(word)))
+        words = list(set(words))
+        valid = yield [lookup.is_word_async(word) for word in words]
+    raise ndb.Return(set(word for word, ok in zip(words, valid) if ok))
+
+
+def urlsafe_to_key(urlsafe):
+    """Returns the ndb.Key for a urlsafe key string. Raises a
+    BadRequestException if the string is malformed."""
+    try:
+        return ndb.Key(urlsafe=urlsafe)
+    except TypeError:
+        raise endpoints.BadRequestException('Invalid Key')
+    except Exception, e:
+        if e.__class__.__name__ == 'ProtocolBufferDecodeError':
+            raise endpoints.BadRequestException('Invalid Key')
+        else:
+            raise
+
+
+@ndb.tasklet
+def get_by_urlsafe_async(urlsafe, model):
+    """Asynchronous version of get_by_urlsafe"""
+    entity = yield urlsafe_to_key(urlsafe).get_async()
+    if not entity:
+        raise ndb.Return(None)
+    if not isinstance(entity, model):
+        raise ValueError('Incorrect Kind')
+    raise ndb.Return(entity)
+
+
 def get_by_urlsafe(urlsafe, model):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
         that the type of entity returned is of the correct kind. Raises an
@@ -49,19 +160,4 @@ def get_by_urlsafe(urlsafe, model):
         exists.
     Raises:
         ValueError:"""
-    try:
-        key = ndb.Key(urlsafe=urlsafe)
-    except TypeError:
-        raise endpoints.BadRequestException('Invalid Key')
-    except Exception, e:
-        if e.__class__.__name__ == 'ProtocolBufferDecodeError':
-            raise endpoints.BadRequestException('Invalid Key')
-        else:
-            raise
-
-    entity = key.get()
-    if not entity:
-        return None
-    if not isinstance(entity, model):
-        raise ValueError('Incorrect Kind')
-    return entity
+    return get_by_urlsafe_async(urlsafe, model).get_result()